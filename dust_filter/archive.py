@@ -0,0 +1,130 @@
+"""compression and retention of the daily data logs
+
+Once a day's logs are closed (the writer has moved on to a later day),
+Archiver compresses them in a background thread - a CSV log
+dust_2020-05-17 becomes dust_2020-05-17.gz (or .xz), a binary log
+dust_2020-05-17.dfl becomes dust_2020-05-17.dfl.gz - and deletes the
+logs of days older than the retention.  Sidecar files (.idx, .crc)
+are left uncompressed; they describe the uncompressed content, which
+doesn't change.
+
+Readers go through find() and read() (or open_log()), which take the
+uncompressed name and use whichever form exists.
+"""
+
+import datetime
+import gzip
+import logging
+import lzma
+import os
+import re
+import shutil
+import threading
+
+COMPRESSORS = {'gz': gzip, 'xz': lzma}
+SIDECARS = ('.idx', '.crc')
+
+def find(path):
+    """the existing file holding path's contents (path itself or a
+    compressed copy), or None"""
+    for p in [path] + [ path + '.' + ext for ext in COMPRESSORS ]:
+        if os.path.exists(p): return p
+    return None
+
+def is_compressed(path):
+    return path.rpartition('.')[2] in COMPRESSORS
+
+def base(path):
+    """the uncompressed name of path"""
+    return path.rpartition('.')[0] if is_compressed(path) else path
+
+def open_log(path):
+    """open a (possibly compressed) log for binary reading"""
+    ext = path.rpartition('.')[2]
+    if ext in COMPRESSORS:
+        return COMPRESSORS[ext].open(path, 'rb')
+    return open(path, 'rb')
+
+def read(path):
+    """the whole (decompressed) contents of a log"""
+    with open_log(path) as f:
+        return f.read()
+
+def _open_compressed(path, method):
+    if method == 'gz':
+        # no timestamp in the header (the file keeps the log's mtime),
+        # so the same log always compresses to the same bytes
+        return gzip.GzipFile(path, 'wb', mtime=0)
+    return COMPRESSORS[method].open(path, 'wb')
+
+def compress(path, method='gz'):
+    """compress path to path.<method> and remove path"""
+    dst = path + '.' + method
+    tmp = dst + '.tmp'
+    with open(path, 'rb') as src, _open_compressed(tmp, method) as f:
+        shutil.copyfileobj(src, f, 1 << 20)
+    shutil.copystat(path, tmp)
+    os.replace(tmp, dst)
+    os.remove(path)
+    return dst
+
+class Archiver(object):
+    """compress closed daily logs and expire old ones
+
+    method is 'gz', 'xz' or None (don't compress); logs more than
+    keep_days days older than the current day are deleted (0: never).
+    """
+
+    def __init__(self, prefix, method='gz', keep_days=0):
+        if method is not None and method not in COMPRESSORS:
+            raise ValueError('unknown compression %r' % method)
+        self.prefix = prefix
+        self.method = method
+        self.keep_days = keep_days
+        self._thread = None
+        name = re.escape(os.path.basename(prefix))
+        self._pattern = re.compile(name + r'(\d{4}-\d{2}-\d{2})'
+                                   r'(\.dfl)?(\.(?:%s))?$'
+                                   % '|'.join(COMPRESSORS))
+
+    def logs(self):
+        """(date, path, compressed) for every data log under prefix"""
+        d = os.path.dirname(self.prefix) or '.'
+        logs = []
+        for fn in sorted(os.listdir(d)):
+            m = self._pattern.match(fn)
+            if not m: continue
+            date = datetime.datetime.strptime(m.group(1), '%Y-%m-%d').date()
+            logs.append( (date, os.path.join(d, fn), bool(m.group(3))) )
+        return logs
+
+    def run(self, today):
+        """compress the logs before today and delete expired ones"""
+        expire = None
+        if self.keep_days:
+            expire = today - datetime.timedelta(days=self.keep_days)
+        for date, path, compressed in self.logs():
+            try:
+                if expire is not None and date < expire:
+                    logging.info('deleting expired data log %s', path)
+                    os.remove(path)
+                    for s in SIDECARS:
+                        s = base(path) + s
+                        if os.path.exists(s): os.remove(s)
+                elif date < today and not compressed and self.method:
+                    logging.info('compressing data log %s', path)
+                    compress(path, self.method)
+            except OSError:
+                logging.exception('failed to archive %s', path)
+
+    def start(self, t):
+        """run() in the background for the day of time t, unless a
+        run is still going"""
+        if self._thread is not None and self._thread.is_alive(): return
+        today = datetime.date.fromtimestamp(t)
+        self._thread = threading.Thread(target=self.run, args=(today,),
+                                        name='archiver', daemon=True)
+        self._thread.start()
+
+    def join(self):
+        if self._thread is not None: self._thread.join()
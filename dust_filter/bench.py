@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""microbenchmarks of the hot paths, with a stored baseline
+
+    python3 -m dust_filter.bench --save      # record bench.json
+    python3 -m dust_filter.bench             # compare against it
+
+Each benchmark times one operation of one component on its own, fed
+with the readings in dustlog.csv: setup builds the component and
+returns a function doing one operation (e.g. one DFControl.update with
+the next reading).  The operation is repeated in batches sized to take
+about --min-time seconds; the fastest batch gives the time per
+operation, which is the least disturbed by the rest of the system.
+
+A run is compared with the baseline file (the results are only
+meaningful on the machine that recorded it, so record one on the Pi):
+a benchmark more than --tolerance slower than its baseline is a
+regression, and the exit status is 1 if there are any.  Where pigpio
+isn't installed, the sensor benchmark gives the Sensor a stand-in with
+the few pigpio names it uses.
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import pathlib
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import numpy as np
+
+BENCHMARKS = collections.OrderedDict() # name -> setup function
+DATA = pathlib.Path(__file__).parent.joinpath('dustlog.csv')
+THRESH = [0.01, 0.02, 0.04, 0.08]
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+def _data():
+    """t, ratio, level arrays from dustlog.csv"""
+    a = np.loadtxt(str(DATA), delimiter=',', ndmin=2)
+    return a[:, 0], a[:, 1], a[:, 2].astype(int)
+
+def _window(seconds=300):
+    """the plot's lists for a seconds-long window of the data"""
+    from .control import DFControl
+    t, r, level = _data()
+    sv, _ = DFControl(THRESH).update_batch(t, r)
+    i = np.searchsorted(t, 1589722625)
+    j = np.searchsorted(t, t[i] + seconds)
+    return (t[i:j].tolist(), level[i:j].tolist(), r[i:j].tolist(),
+            sv[i:j].tolist(), THRESH)
+
+def _readings():
+    """a function returning the i-th reading of dustlog.csv as (t,
+    ratio, level), repeating the data forever with increasing times"""
+    t, r, level = _data()
+    n = len(t)
+    period = t[-1] - t[0] + 5
+    t, r, level = t.tolist(), r.tolist(), level.tolist()
+    def reading(i):
+        j = i % n
+        return t[j] + (i // n) * period, r[j], level[j]
+    return reading
+
+@benchmark('control.update')
+def bench_control(tmp):
+    from .control import DFControl
+    dfc = DFControl(THRESH)
+    reading, i = _readings(), itertools.count()
+    def op():
+        t, r, level = reading(next(i))
+        dfc.update(r, t)
+    return op
+
+def _pigpio_stub():
+    """a module with the parts of pigpio the Sensor uses"""
+    def tickDiff(t1, t2):
+        # as pigpio's: microseconds from t1 to t2, across the wraparound
+        d = t2 - t1
+        if d < 0: d += 1 << 32
+        return d
+    m = types.ModuleType('pigpio')
+    m.INPUT, m.EITHER_EDGE, m.tickDiff = 0, 2, tickDiff
+    return m
+
+@benchmark('sensor.cbf')
+def bench_sensor(tmp):
+    from . import PPD42NS
+    from .PPD42NS import Sensor
+    from .mock_classes import MockPi
+    if not hasattr(PPD42NS, 'pigpio'): # not installed
+        PPD42NS.pigpio = _pigpio_stub()
+
+    # one low pulse per 100 ms, as long as the data's low occupancy,
+    # starting just before the 32-bit microsecond tick wraps around
+    t, r, level = _data()
+    period = 100000
+    start = (1 << 32) - 10 * period
+    fall = start + np.arange(len(r)) * period
+    rise = fall + (r * period).astype(int)
+    ticks = (np.stack((fall, rise), axis=1).ravel() % (1 << 32)).tolist()
+
+    class TickPi(MockPi):
+        """MockPi with the calls the Sensor makes"""
+        def get_current_tick(self): return start
+        def set_mode(self, gpio, mode): pass
+        def callback(self, gpio, edge, func): return None
+
+    pi = TickPi()
+    pi.write(25, 1) # high until the first falling edge
+    s = Sensor(pi, 25)
+    edges = itertools.cycle(zip(itertools.cycle((0, 1)), ticks))
+    def op():
+        lv, tick = next(edges)
+        s._cbf(25, lv, tick)
+    return op
+
+@benchmark('motor.set')
+def bench_motor(tmp):
+    from .motor import Motor
+    from .mock_classes import MockPi
+    t, r, level = _data()
+    m = Motor(MockPi(), [21, 26, 20], limit=0)
+    levels = itertools.cycle(level.tolist())
+    return lambda: m.set(next(levels))
+
+def _log_writer(log, flush_every=12):
+    t, r, level = _data()
+    rows = itertools.cycle(zip(t.tolist(), r.tolist(), level.tolist()))
+    n = itertools.count(1)
+    def op():
+        ti, ri, li = next(rows)
+        log.write(ti, ri, ri, li, 'Auto')
+        if next(n) % flush_every == 0: log.flush()
+    return op
+
+@benchmark('datefile.write')
+def bench_datefile(tmp):
+    from .mdsutils.datefile import DateFile
+    f = DateFile(os.path.join(tmp, 'datefile_'), '%Y-%m-%d')
+    t, r, level = _data()
+    rows = itertools.cycle('%r,%r,%d\n' % row for row in
+                           zip(t.tolist(), r.tolist(), level.tolist()))
+    def op():
+        f.write(next(rows))
+        f.flush()
+    return op
+
+@benchmark('dailycsv.write')
+def bench_dailycsv(tmp):
+    from .logwriter import DailyCSV
+    return _log_writer(DailyCSV(os.path.join(tmp, 'csv_')))
+
+@benchmark('binarylog.write')
+def bench_binarylog(tmp):
+    from .datalog import BinaryLog
+    return _log_writer(BinaryLog(os.path.join(tmp, 'bin_')))
+
+@benchmark('core.send_plot_data')
+def bench_send_plot_data(tmp):
+    from .replay import VirtualClock, ReplayPlotConn, ReplayFilter
+    clock = VirtualClock()
+    settings = {'data_prefix': os.path.join(tmp, 'dust_'),
+                'rollup_prefix': os.path.join(tmp, 'rollup_'),
+                'lazy_plots': False, 'thresholds': THRESH}
+    df = ReplayFilter(clock, ReplayPlotConn(clock), settings)
+    df.logwriter.close() # not needed
+    reading, i = _readings(), itertools.count()
+    def op():
+        t, r, level = reading(next(i))
+        clock.t = t
+        df.send_plot_data( (t, level, r, r) )
+    return op
+
+@benchmark('plots.mobile_plot')
+def bench_mobile_plot(tmp):
+    from . import plots
+    w = _window()
+    return lambda: plots.mobile_plot(*w)
+
+@benchmark('plots.MobilePlot')
+def bench_mobileplot_render(tmp):
+    from . import plots
+    w = _window()
+    mp = plots.MobilePlot()
+    return lambda: mp.render(*w)
+
+class _Echo(object):
+    def _rpc_index(self):
+        return {'selected': 'Auto', 'active': 1, 'average': 1.23,
+                'thresholds': [1.0, 2.0, 4.0, 8.0]}
+
+@benchmark('mtpw.round_trip')
+def bench_rpc(tmp):
+    from .mtpw import PipeWrapCaller, PipeWrapServer
+    conn, child = multiprocessing.Pipe()
+    server = PipeWrapServer(child, _Echo(), '_rpc_')
+    def serve():
+        try:
+            while True: server.handle()
+        except (EOFError, OSError):
+            pass
+    threading.Thread(target=serve, daemon=True).start()
+    return PipeWrapCaller(conn).index
+
+@benchmark('conversions')
+def bench_conversions(tmp):
+    from .PPD42NS import ratio_to_conc
+    from .conversions import pcs_to_ugm3, ugm3_to_aqi
+    t, r, level = _data()
+    ratios = itertools.cycle(r.tolist())
+    return lambda: ugm3_to_aqi(pcs_to_ugm3([ratio_to_conc(next(ratios))]))
+
+def measure(op, min_time=0.2, repeat=5):
+    """(fastest, median) seconds per call of op, over repeat batches
+    of calls each taking about min_time"""
+    n = 1
+    while True:
+        t0 = time.perf_counter()
+        for i in range(n): op()
+        dt = time.perf_counter() - t0
+        if dt >= min_time / 10: break
+        n *= 10
+    n = max(1, int(n * min_time / dt))
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        for i in range(n): op()
+        times.append( (time.perf_counter() - t0) / n )
+    times.sort()
+    return times[0], times[len(times) // 2]
+
+def run(names=None, min_time=0.2, repeat=5):
+    """run the benchmarks; returns {name: {'us', 'median_us'}}"""
+    results = collections.OrderedDict()
+    tmp = tempfile.mkdtemp(prefix='dfbench')
+    try:
+        for name, setup in BENCHMARKS.items():
+            if names and name not in names: continue
+            op = setup(tmp)
+            best, median = measure(op, min_time, repeat)
+            results[name] = {'us': 1e6 * best, 'median_us': 1e6 * median}
+    finally:
+        shutil.rmtree(tmp)
+    return results
+
+def compare(results, baseline, tolerance):
+    """lines of a report, and the names of the regressions"""
+    lines, regressions = [], []
+    for name, res in results.items():
+        base = baseline.get(name, {}).get('us')
+        if base is None:
+            lines.append('%-22s %10.2f us' % (name, res['us']))
+            continue
+        change = res['us'] / base - 1
+        flag = ''
+        if change > tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif change < -tolerance:
+            flag = '  faster'
+        lines.append('%-22s %10.2f us  baseline %10.2f us  %+6.1f%%%s'
+                     % (name, res['us'], base, 100 * change, flag))
+    return lines, regressions
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='benchmark the hot paths')
+    a = p.add_argument
+    a('names', nargs='*', help='benchmarks to run (default: all)')
+    a('-b', '--baseline', default='bench.json',
+      help='baseline file (default: %(default)s)')
+    a('--save', action='store_true',
+      help='record the results as the baseline')
+    a('-t', '--tolerance', type=float, default=0.10,
+      help='flag benchmarks this much slower than the baseline '
+      '(default: %(default)s)')
+    a('--min-time', type=float, default=0.2,
+      help='seconds per batch of calls (default: %(default)s)')
+    a('--repeat', type=int, default=5, help='batches per benchmark')
+    a('-l', '--list', action='store_true', help='list the benchmarks')
+    args = p.parse_args(argv)
+
+    if args.list:
+        print('\n'.join(BENCHMARKS))
+        return 0
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown: p.error('unknown benchmarks: %s' % ', '.join(sorted(unknown)))
+
+    baseline = {}
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    results = run(args.names, args.min_time, args.repeat)
+    lines, regressions = compare(results, baseline, args.tolerance)
+    print('\n'.join(lines))
+    if args.save:
+        if args.names and os.path.exists(args.baseline):
+            # update just these benchmarks in the existing baseline
+            with open(args.baseline) as f:
+                old = json.load(f)['results']
+            old.update(results)
+            results = old
+        with open(args.baseline, 'w') as f:
+            json.dump({'machine': platform.node(),
+                       'platform': platform.platform(),
+                       'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'results': results}, f, indent=2)
+            f.write('\n')
+        print('saved baseline %s' % args.baseline)
+    elif regressions:
+        print('%d regression(s) beyond %.0f%%: %s'
+              % (len(regressions), 100 * args.tolerance,
+                 ', '.join(regressions)))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
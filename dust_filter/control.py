@@ -1,5 +1,60 @@
+import array
 import time
 
+import numpy as np
+
+class SampleRing(object):
+    """fixed-capacity ring buffer of (t, v, sv) samples
+
+    The samples live in three preallocated array('d') columns, so
+    appending and dropping samples does not allocate.  Samples are
+    addressed by absolute index: start is the oldest sample still held
+    and end is one past the newest.  If more than capacity samples are
+    ever held at once, the ring doubles its capacity.
+    """
+
+    def __init__(self, capacity=128):
+        self.capacity = capacity
+        self.start = 0
+        self.end = 0
+        self._t = array.array('d', bytes(8 * capacity))
+        self._v = array.array('d', bytes(8 * capacity))
+        self._sv = array.array('d', bytes(8 * capacity))
+
+    def __len__(self):
+        return self.end - self.start
+
+    def append(self, t, v, sv):
+        if self.end - self.start == self.capacity:
+            self._grow()
+        i = self.end % self.capacity
+        self._t[i] = t
+        self._v[i] = v
+        self._sv[i] = sv
+        self.end += 1
+
+    def popleft(self):
+        self.start += 1
+
+    def t(self, i):
+        return self._t[i % self.capacity]
+
+    def v(self, i):
+        return self._v[i % self.capacity]
+
+    def sv(self, i):
+        return self._sv[i % self.capacity]
+
+    def _grow(self):
+        old = (self._t, self._v, self._sv)
+        oldcap = self.capacity
+        self.capacity = 2 * oldcap
+        self._t, self._v, self._sv = new = \
+            [ array.array('d', bytes(8 * self.capacity)) for o in old ]
+        for i in range(self.start, self.end):
+            for o, n in zip(old, new):
+                n[i % self.capacity] = o[i % oldcap]
+
 class DFControl(object):
     """control loop manager
 
@@ -10,25 +65,36 @@ class DFControl(object):
         60-second ave < TH[i-1] for 5 minutes
     """
 
-    def __init__(self, thresholds, smooth_win=60, min_run=300):
+    def __init__(self, thresholds, smooth_win=60, min_run=300, capacity=128):
         self.thresholds = thresholds
         self.smooth_win = smooth_win
         self.min_run = min_run
-        self._buf = []
+        self._buf = SampleRing(capacity)
         self._buf_len = smooth_win + min_run
+        self._win = 0        # index of the oldest sample in the smooth window
+        self._win_sum = 0.0  # running sum of the values in the smooth window
         self.level = 0
         self._last_above = [ 0.0 for t in thresholds ]
         self._sv = None
 
     def _update_buf(self, v, t=None):
         if t is None: t = time.time()
+        b = self._buf
 
-        while self._buf and self._buf[0][0] < t - self._buf_len:
-            self._buf.pop(0)
-        raw = [ a[1] for a in self._buf if a[0] > t - self.smooth_win ]
-        raw.append(v)
-        sv = sum(raw)/len(raw)
-        self._buf.append( (t, v, sv) )
+        # leave the smooth window before dropping out of the buffer, so
+        # every sample dropped is also taken off the running sum
+        while self._win < b.end and not b.t(self._win) > t - self.smooth_win:
+            self._win_sum -= b.v(self._win)
+            self._win += 1
+        while len(b) and b.t(b.start) < t - self._buf_len:
+            b.popleft()
+
+        if self._win == b.end or b.end % b.capacity == 0:
+            # resync the running sum so rounding error can't accumulate
+            self._win_sum = sum([ b.v(i) for i in range(self._win, b.end) ])
+        self._win_sum += v
+        sv = self._win_sum / (b.end + 1 - self._win)
+        b.append(t, v, sv)
         self._sv = sv
 
     def _update_level(self, t=None):
@@ -43,13 +109,18 @@ class DFControl(object):
                 break
 
     def set_thresholds(self, thresholds):
+        b = self._buf
         la = []
-        for t in thresholds:
-            above = [0.0] + [ t for (t, v, sv) in self._buf if sv > t ]
-            la.append(above[-1])
+        for th in thresholds:
+            above = 0.0
+            for i in range(b.end - 1, b.start - 1, -1):
+                if b.sv(i) > th:
+                    above = b.t(i)
+                    break
+            la.append(above)
         self._last_above = la
         self.thresholds = thresholds
-        self._update_level
+        if len(b): self._update_level(b.t(b.end - 1))
         return self.level
 
     def update(self, v, t=None):
@@ -58,6 +129,80 @@ class DFControl(object):
         self._update_level(t)
         return self.level
 
+    def update_batch(self, t, v):
+        """feed a whole series of samples through the controller at once
+
+        t = array of unix timestamps (increasing)
+        v = array of sensor readings (one for each timestamp)
+
+        This is equivalent to calling update(v[i], t[i]) for each
+        sample in turn, and leaves the controller in the same state, so
+        scalar and batch updates can be freely mixed.
+
+        return (sv, level), arrays of the smoothed value and the level
+        after each sample
+        """
+        t = np.asarray(t, dtype=float)
+        v = np.asarray(v, dtype=float)
+        n = len(t)
+        nth = len(self.thresholds)
+        if n == 0:
+            return np.zeros(0), np.zeros(0, dtype=int)
+
+        # smoothing: prepend the samples we already hold so the first
+        # windows of the batch see them, then average each window as a
+        # difference of cumulative sums
+        b = self._buf
+        held = range(b.start, b.end)
+        ta = np.concatenate(([ b.t(i) for i in held ], t))
+        va = np.concatenate(([ b.v(i) for i in held ], v))
+        cs = np.concatenate(([0.0], np.cumsum(va)))
+        hi = np.arange(len(held) + 1, len(ta) + 1)
+        lo = np.searchsorted(ta, ta[len(held):] - self.smooth_win, 'right')
+        sv = (cs[hi] - cs[lo]) / (hi - lo)
+
+        # hysteresis: for each threshold, when was sv last above it?
+        th = np.asarray(self.thresholds, dtype=float)
+        above = sv[:, None] > th[None, :]
+        la = np.where(above, t[:, None], np.asarray(self._last_above)[None, :])
+        la = np.maximum.accumulate(la, axis=0)
+
+        # update() walks the thresholds and stops at the first stale one
+        # (j), raising the level to the highest threshold exceeded below
+        # it (a) and then capping it at j.  Since a < j, every step is a
+        # clamp of the previous level into [a, j].
+        stale = t[:, None] - la > self.min_run
+        j = np.where(stale.any(axis=1), stale.argmax(axis=1), nth)
+        idx = np.arange(nth)
+        a = np.where(above & (idx[None, :] < j[:, None]), idx[None, :], 0)
+        a = a.max(axis=1)
+
+        # each "level >= c" bit is a set/reset latch, so the level is the
+        # sum of the latches
+        k = np.arange(n)
+        level = np.zeros(n, dtype=int)
+        for c in range(1, nth):
+            last_set = np.maximum.accumulate(np.where(a >= c, k, -1))
+            last_reset = np.maximum.accumulate(np.where(j < c, k, -1))
+            on = np.where(last_set == last_reset, self.level >= c,
+                          last_set > last_reset)
+            level += on
+
+        # carry the state over so scalar updates continue seamlessly
+        sva = np.concatenate(([ b.sv(i) for i in held ], sv))
+        keep = np.searchsorted(ta, ta[-1] - self._buf_len, 'left')
+        while len(b): b.popleft()
+        for ti, vi, si in zip(ta[keep:].tolist(), va[keep:].tolist(),
+                              sva[keep:].tolist()):
+            b.append(ti, vi, si)
+        self._win = b.start + int(np.searchsorted(ta[keep:],
+                                    ta[-1] - self.smooth_win, 'right'))
+        self._win_sum = sum([ b.v(i) for i in range(self._win, b.end) ])
+        self._last_above = la[-1].tolist()
+        self._sv = float(sv[-1])
+        self.level = int(level[-1])
+        return sv, level
+
     def _old_update(self, v, t=None):
         if t is None: t = time.time()
 
@@ -79,5 +224,21 @@ class DFControl(object):
     def poll(self):
         pass        
 
+def _bench(rates=(1, 10, 100), seconds=3600):
+    """time DFControl.update at several sample rates"""
+    import random
+    thresh = [0.01, 0.02, 0.04, 0.08]
+    for hz in rates:
+        dfc = DFControl(thresh)
+        n = int(seconds * hz)
+        t0 = 1589722589.97081
+        samples = [ (t0 + i / hz, random.uniform(0, 0.1)) for i in range(n) ]
+        start = time.perf_counter()
+        for ti, vi in samples:
+            dfc.update(vi, ti)
+        dt = time.perf_counter() - start
+        print('%4d Hz: %7d updates, %6.2f us/update (capacity %d)'
+              % (hz, n, 1e6 * dt / n, dfc._buf.capacity))
+
 if __name__ == '__main__':
-    pass
+    _bench()
@@ -1,10 +1,10 @@
 #!/usr/bin/env python
 
 import math
-import collections
+import collections.abc
 
 def pcs_to_ugm3(concentration_pcf):
-    if isinstance(concentration_pcf, collections.Sequence):
+    if isinstance(concentration_pcf, collections.abc.Sequence):
         return [ _pcs_to_ugm3(c) for c in concentration_pcf ]
     else:
         return concentration_pcf
@@ -39,7 +39,7 @@ def _pcs_to_ugm3(concentration_pcf):
     return concentration_ugm3
 
 def ugm3_to_aqi(ugm3):
-    if isinstance(ugm3, collections.Sequence):
+    if isinstance(ugm3, collections.abc.Sequence):
         return [ _ugm3_to_aqi(c) for c in ugm3 ]
     else:
         return ugm3
@@ -3,42 +3,40 @@
 
 import sys
 import time
-import csv
 import multiprocessing
 import logging
 import math
 import select
 import pprint
+import collections
+import itertools
 
 from . import plots
 from . import dfserver
 
 from .PPD42NS import Sensor
-from .mdsutils.datefile import DateFile
+from .datalog import BinaryLog
+from .logwriter import DailyCSV, LogWriter
+from .archive import Archiver
 from .control import DFControl
 from .motor import Motor
 from .mdsutils import config
+from .snapshot import StateSnapshot
+from .mtpw import PipeWrapServer
+from .rollup import Rollup, WINDOWS
+from .metrics import Metrics
+from .defaults import DEFAULT_CONFIG, CONFIG_PATH
 
-DEFAULT_CONFIG = """
-sensor_gpio: 25
-motor_gpios: [21, 26, 20]
-poll: 5 # seconds
-thresholds: [0.02, 0.04, 0.08, 0.16]
-mode: Auto  # Auto, Off, Low, Med, High
-data_prefix: log/dust_
-log_prefix: log/dust.log
-mock: false
-mock_start: 1589722589.97081
-mock_speed: 1.0
-"""
-
-CONFIG_PATH=['/etc/df2000.yaml', './df2000.yaml']
 
 #    config = {'sensor_gpio': 25,
 #              'motor_gpios': [21, 26, 20],
 #              'poll': 5,# seconds
 #              'thresholds': [0.01, 0.02, 0.04, 0.08]
 
+# the parts of read_sensor (and of the loop) timed in df_stage_seconds
+STAGES = ('sensor_read', 'control_update', 'log_write', 'motor_set',
+          'plot_send', 'select_wait')
+
 MODEMAP={0: 'Off',
          1: 'Low',
          2: 'Med',
@@ -46,25 +44,57 @@ MODEMAP={0: 'Off',
          'Auto': 'Auto'}
 for k, v in list(MODEMAP.items()): MODEMAP[v] = k
 
+def mode_level(mode):
+    """a mode as kept in conf.mode: 'Auto' or a motor level (0-3).
+    mode can be a level or a name from MODEMAP."""
+    if mode == 'Auto': return mode
+    if isinstance(mode, str): return MODEMAP[mode]
+    return int(mode)
+
 class DustFilter(object):
-    def __init__(self, plot_conn, web_conn):
+    PLOT_TIMEOUT = 5.0 # seconds before asking again for a requested plot
+    # set in __init__, but exit() can be called (by config()) before then
+    snapshot = rollup = logwriter = None
+
+    def __init__(self, plot_conn, web_conn, event_conn=None, snapshot=None):
         self.last_r = 0 # this is a brute-force hack to reject outliers... I
                    # should make it cleaner at some point
         self.config()
+        self.conf.mode = mode_level(self.conf.mode)
         self.plot_conn = plot_conn
         self.web_conn = web_conn
+        self.rpc = PipeWrapServer(web_conn, self, '_web_')
+        self.event_conn = event_conn
+        self.snapshot = snapshot
         self.speedup = 1.0
-        self.datapoints = []
-        self.plot_length = 5*60
+        self.datapoints = collections.deque()
+        self.plot_length = WINDOWS['5m'][1]
+        self.rollup = Rollup(self.conf.rollup_prefix)
+        self._window_plots = {}       # window -> (time, png data, gen)
         self._plot_data = None
+        self._plot_time = 0
+        self._plot_gen = 0            # bumped for every rendered plot
+        self._plot_expires = 0.0      # wall-clock time the plot goes stale
+        self._plot_request_time = None
+        self._plot_pending = {}       # window -> time its plot was asked for
+        self._plot_sent_t = None      # newest point the plot process has
+        self._plot_sent_thresh = None # thresholds the plot process has
         self.level = 0
 
+        self.metrics = m = Metrics()
+        self._stage = dict( (s, m.histogram('df_stage_seconds', stage=s))
+                            for s in STAGES )
+        self._lateness = m.histogram('df_schedule_lateness_seconds')
+        self._readings = m.counter('df_readings_total')
+        self._suppressed = m.counter('df_high_readings_suppressed_total')
+        self._plot_metrics = [] # the plot process's, from its last reply
+
         c = self.conf
         if c.mock:
             from .mock_classes import MockPi, MockSensor
             self._time = self._mock_time
             self.pi = MockPi()
-            self.sensor = MockSensor(self._time)
+            self.sensor = MockSensor(self._time, c.mock_data, c.mock_loop)
             self.speedup = c.mock_speed
         else:
             try:
@@ -76,10 +106,17 @@ class DustFilter(object):
             self.pi = pigpio.pi()
             self.sensor = Sensor(self.pi, c.sensor_gpio)
 
-        self.motor = Motor(self.pi, c.motor_gpios)
-        self.datalog = DateFile(c.data_prefix, '%Y-%m-%d')
+        self.motor = Motor(self.pi, c.motor_gpios, timefunc=self._time)
+        logs = [DailyCSV(c.data_prefix)]
+        if c.binary_log: logs.append(BinaryLog(c.data_prefix))
+        method = None if c.log_compress == 'none' else c.log_compress
+        self.archiver = Archiver(c.data_prefix, method, c.log_keep_days)
+        self.logwriter = LogWriter(logs,
+                                   flush_records=c.log_flush_records,
+                                   flush_interval=c.log_flush_interval,
+                                   fsync=c.log_fsync,
+                                   on_rotate=self.archiver.start)
         self.control = DFControl(c.thresholds)
-        self.writer = csv.writer(self.datalog)
 
     def config(self):
         p = config.ArgumentParser()
@@ -106,6 +143,11 @@ class DustFilter(object):
     def exit(self):
         for c in multiprocessing.active_children():
             c.terminate()
+        if self.rollup is not None: self.rollup.close()
+        if self.logwriter is not None: self.logwriter.close()
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot.unlink()
         sys.exit()
 
     def dump_config(self):
@@ -113,43 +155,114 @@ class DustFilter(object):
         pass
 
     def read_sensor(self):
+        stage, clock = self._stage, time.perf_counter
         t = self._time()
+        t0 = clock()
         r = self.sensor.read()
+        t1 = clock()
+        stage['sensor_read'].observe(t1 - t0)
+        self._readings.inc()
         if r > 0.8:
             logging.warn('HIGH READING: read r = %0.5f, suppressing', r)
+            self._suppressed.inc()
             r = self.last_r # log... log it!
         else:
             self.last_r = r
+        old_level = self.level
+        t1 = clock()
         self.level = self.control.update(r, t)
+        t2 = clock()
+        stage['control_update'].observe(t2 - t1)
         logging.debug('read r=%0.4f from sensor, level=%d', r, self.level)
-        self.writer.writerow( (t, r, self.level) )
-        self.datalog.flush()
-        if self.conf.mode == 'Auto':
-            self.motor.set(self.level)
-        else:
-            self.motor.set(self.conf.mode)
+        t2 = clock() # the stages don't include the logging
+        self.logwriter.put(t, r, self.control._sv, self.level,
+                           self.conf.mode)
+        t3 = clock()
+        motor_level = self._motor_level()
+        self.motor.set(motor_level)
+        t4 = clock()
+        stage['motor_set'].observe(t4 - t3)
 
         datapoint = (t, self.level, r, self.control._sv)
+        self.rollup.add(*datapoint, motor=motor_level)
+        t5 = clock()
+        stage['log_write'].observe(t3 - t2 + t5 - t4)
         self.send_plot_data( datapoint )
+        stage['plot_send'].observe(clock() - t5)
+        self.publish('reading', {'t': t, 'level': self.level,
+                                 'raw': 100 * r,
+                                 'ave': 100 * self.control._sv})
+        self._update_state('level' if not self.level == old_level else None)
+
+    def _update_state(self, event=None):
+        """refresh the shared state snapshot, and publish the state as
+        event if one is given"""
+        if self.control._sv is None: return # no readings yet
+        if self.snapshot is None and \
+           (event is None or self.event_conn is None):
+            return # nobody to tell
+        state = self._web_index()
+        state['plot_gen'] = self._plot_gen
+        state['plot_expires'] = self._plot_expires
+        if self.snapshot is not None:
+            self.snapshot.write(state, self._time())
+        if event is not None:
+            self.publish(event, state)
+
+    def publish(self, event, data):
+        """send an event to the web process, which fans it out to all
+        of the /events subscribers"""
+        if self.event_conn is None: return
+        try:
+            self.event_conn.send( (event, data) )
+        except Exception as e:
+            logging.exception('failed to publish %s event', event)
+
+    def send_plot_data(self, datapoint=None, force=False):
+        """add a datapoint to the plot history and, unless plots are
+        lazy and nobody has asked for one recently, ask the plot process
+        for a new plot.  Returns True if a plot was requested.
 
-    def send_plot_data(self, datapoint=None):
+        The plot process keeps its own copy of the history, so only the
+        points (and thresholds) it hasn't seen yet are sent.
+        """
         dp = self.datapoints
         if datapoint is not None: dp.append(datapoint)
         now = self._time()
-        while dp[0][0] < now - self.plot_length:
-            dp.pop(0)
-        t, l, rr, ra = tuple(zip(*dp))
+        start = now - self.plot_length
+        while dp and dp[0][0] < start:
+            dp.popleft()
+        if len(dp) < 4: return False
+        if not force and self.conf.lazy_plots and \
+           (self._plot_request_time is None or
+            now - self._plot_request_time > self.conf.plot_active):
+            return False
+        new = self._points_since(self._plot_sent_t)
         thresh = self.conf.thresholds
-        if len(t) < 4: return
-        logging.debug('sending plot data (%d points)', len(t))
-        self.plot_conn.send( (t, l, rr, ra, thresh) )
-        
+        if thresh == self._plot_sent_thresh: thresh = None
+        logging.debug('sending plot data (%d new points)', len(new))
+        self.plot_conn.send( ('5m', new, thresh, start) )
+        if new: self._plot_sent_t = new[-1][0]
+        if thresh is not None: self._plot_sent_thresh = list(thresh)
+        return True
+
+    def _points_since(self, since=None):
+        """return a list of the datapoints newer than since"""
+        dp = self.datapoints
+        if since is None: return list(dp)
+        i = len(dp)
+        while i and dp[i-1][0] > since:
+            i -= 1
+        return list(itertools.islice(dp, i, None))
+
     def select_helpers(self, until):
         timeout = until - self._time()
         if timeout < 0: timeout = 0
 
+        t0 = time.perf_counter()
         r, w, x = select.select([self.web_conn, self.plot_conn],
                                 [], [], timeout/self.speedup)
+        self._stage['select_wait'].observe(time.perf_counter() - t0)
         if not r: return
         # we have something to do!
         if self.plot_conn in r:
@@ -158,31 +271,43 @@ class DustFilter(object):
             self.web_request()
 
     def plot_response(self):
+        """receive a plot from the plot process; returns its window"""
         logging.debug('receiving plot image')
-        self._plot_data = self.plot_conn.recv()
+        window, data, self._plot_metrics = self.plot_conn.recv()
+        self.metrics.counter('df_plot_renders_total', window=window).inc()
+        self._plot_pending.pop(window, None)
+        if not window == '5m':
+            gen = self._window_plots.get(window, (0, None, 0))[2] + 1
+            self._window_plots[window] = (self._time(), data, gen)
+            return window
+        self._plot_data = data
         self._plot_time = self._time()
+        self._plot_gen += 1
+        self._plot_expires = time.time() + \
+            self.conf.plot_max_age / self.speedup
+        self._update_state()
+        return window
+
+    def _plot_wanted(self, window):
+        """True if a plot of window should be asked for: none is on its
+        way (or the last request is PLOT_TIMEOUT seconds old)"""
+        asked = self._plot_pending.get(window)
+        return asked is None or \
+            time.time() - asked > self.PLOT_TIMEOUT
 
     def web_request(self):
         try:
-            meth, args, kwargs = self.web_conn.recv()
+            self.rpc.handle()
         except EOFError:
             logging.exception('EOF received from web server process')
             self.exit()
         except Exception as e:
             logging.exception('exception raised in web_request')
-            return None
-        logging.debug('handling web request: (%s, %s, %s)',
-                      meth, args, kwargs)
-        try:
-            resp = getattr(self, '_web_'+meth)(*args, **kwargs)
-            self.web_conn.send(resp)
-        except Exception as e:
-            logging.exception('exception raised in web_request: (%s, %s, %s)',
-                              meth, args, kwargs)
-            return None
 
-        logging.debug('web request: (%s, %s, %s) -> %20.20s',
-                      meth, args, kwargs, resp)
+    def _motor_level(self):
+        """the level the motor should run at in the current mode"""
+        if self.conf.mode == 'Auto': return self.level
+        return self.conf.mode
 
     def _web_index(self):
         r = {'selected': MODEMAP[self.conf.mode],
@@ -191,17 +316,91 @@ class DustFilter(object):
              'thresholds': [ 100 * t for t in self.conf.thresholds] }
         return r
 
-    def _web_image(self):
+    def _web_image(self, window='5m'):
+        """the latest plot of window, or None if there isn't one yet
+
+        This never waits for the plot process: a stale plot is returned
+        as it is and a new one asked for; it replaces the stale one
+        (and bumps the generation the web server watches) when it
+        arrives through the select loop.
+        """
+        if not window == '5m': return self._window_image(window)
+        now = self._time()
+        self._plot_request_time = now
+        if now - self._plot_time > self.conf.plot_max_age and \
+           self._plot_wanted('5m'):
+            # stale (we've been idle) - ask for a new one
+            logging.debug('plot is %.1f seconds old, rendering on demand',
+                          now - self._plot_time)
+            if self.send_plot_data(force=True):
+                self._plot_pending['5m'] = time.time()
         logging.debug('sending plot image to web server')        
-        return self._plot_data
+        if self._plot_data is None: return None
+        return {'gen': self._plot_gen, 'data': self._plot_data}
+
+    def _window_image(self, window):
+        """plot of one of the longer windows, drawn from a rollup tier
+        and re-rendered on request once it's a bucket width old; like
+        the 5-minute plot, the old one is returned meanwhile"""
+        tier, span = WINDOWS[window]
+        tier = self.rollup[tier]
+        now = self._time()
+        cached = self._window_plots.get(window)
+        if (cached is None or now - cached[0] > tier.width) and \
+           self._plot_wanted(window):
+            pts = tier.points(now - span)
+            if len(pts) >= 2:
+                logging.debug('sending %s plot data (%d points)',
+                              window, len(pts))
+                thresh = self.conf.thresholds
+                self.plot_conn.send( (window, pts, thresh, now - span) )
+                self._plot_sent_thresh = list(thresh)
+                self._plot_pending[window] = time.time()
+        if cached is None: return None
+        return {'gen': cached[2], 'data': cached[1]}
     
+    def _web_series(self, since=None, window='5m'):
+        """return the plot datapoints (t, level, raw, average) newer than
+        since, along with the current thresholds.  For the longer
+        windows, the points are rollup buckets."""
+        tier, span = WINDOWS[window]
+        if tier is None:
+            points = self._points_since(since)
+        else:
+            start = self._time() - span
+            if since is not None: start = max(start, since)
+            points = self.rollup[tier].points(start)
+        return {'thresholds': self.conf.thresholds, 'points': points}
+
+    def _web_metrics(self):
+        """{process: metrics snapshot} for the core and the plot
+        process (as of its last plot)"""
+        m = self.metrics
+        m.counter('df_motor_transitions_total').value = \
+            self.motor.transitions
+        m.counter('df_rpc_requests_total').value = self.rpc.requests
+        m.counter('df_rpc_errors_total').value = self.rpc.errors
+        s = self.logwriter.stats()
+        m.gauge('df_datalog_queue').set(s['queue'])
+        m.counter('df_datalog_written_total').value = s['written']
+        m.counter('df_datalog_dropped_total').value = s['dropped']
+        return {'core': m.snapshot(), 'plot': self._plot_metrics}
+
+    def _web_history_conf(self):
+        """what the web server needs to serve history from the files"""
+        c = self.conf
+        return {'data_prefix': c.data_prefix,
+                'rollup_prefix': c.rollup_prefix,
+                'points': c.history_points,
+                'poll': c.poll}
+
     def _web_mode(self, mode):
         oldmode = self.conf.mode
-        self.conf.mode = MODEMAP[mode]
+        self.conf.mode = mode_level(mode)
         logging.info('setting mode from %s to %s at user command',
-                     oldmode, self.conf.mode)
-        if self.conf.mode == 'Auto': self.motor.set(self.level)
-        else:                        self.motor.set(self.conf.mode)
+                     MODEMAP[oldmode], MODEMAP[self.conf.mode])
+        self.motor.set(self._motor_level())
+        self._update_state('mode')
 
     def _web_settings(self, settings=None):
         if settings is not None:
@@ -218,8 +417,8 @@ class DustFilter(object):
         self.conf.thresholds = thresholds
         self.level = self.control.set_thresholds(thresholds)
         self.send_plot_data()
-        if self.conf.mode == 'Auto': self.motor.set(self.level)
-        else:                        self.motor.set(self.conf.mode)
+        self.motor.set(self._motor_level())
+        self._update_state('settings')
         
         self.dump_config()
         
@@ -227,7 +426,9 @@ class DustFilter(object):
         next_read_time = math.ceil(self._time())
         while True:
             self.select_helpers(next_read_time)
-            if self._time() > next_read_time:
+            now = self._time()
+            if now > next_read_time:
+                self._lateness.observe((now - next_read_time) / self.speedup)
                 self.read_sensor()
                 next_read_time = next_read_time + self.conf.poll
         self.pi.stop() # Disconnect from Pi.
@@ -292,16 +493,20 @@ def start_helpers():
     multiprocessing.Process(target=plots.plotproc, name='plot',
                             args=(logq, plot_child_conn)).start()
 
-    # for the web server process
+    # for the web server process: requests, one-way events and the
+    # shared state snapshot
     web_conn, web_child_conn = multiprocessing.Pipe()
+    event_child_conn, event_conn = multiprocessing.Pipe(duplex=False)
+    snapshot = StateSnapshot(create=True)
     multiprocessing.Process(target=dfserver.main, name='web',
-                            args=(logq, web_child_conn)).start()
+                            args=(logq, web_child_conn, event_child_conn,
+                                  snapshot.name)).start()
 
-    return logq, plot_conn, web_conn
+    return logq, plot_conn, web_conn, event_conn, snapshot
 
 def main():
-    logq, plot_conn, web_conn = start_helpers()
-    df = DustFilter(plot_conn, web_conn)
+    logq, plot_conn, web_conn, event_conn, snapshot = start_helpers()
+    df = DustFilter(plot_conn, web_conn, event_conn, snapshot)
     logq.put(df.conf.log_prefix)
     logging.info('starting DustFilter instance')
     df.loop()
@@ -0,0 +1,194 @@
+"""fixed-record binary data log
+
+An optional companion to the CSV data log: each reading is packed into
+a RECORD_SIZE-byte record (time, raw ratio, smoothed value, level,
+mode), so months of data can be read back with numpy.memmap instead of
+parsing text.  Files rotate like DateFile: one per strftime(fmt) of
+the reading's local time, named base + date + SUFFIX.
+
+    file:    HEADER, then records back to back
+    .crc:    one little-endian uint32 zlib.crc32 per completed block of
+             BLOCK_RECORDS records
+
+The checksums live in a sidecar file so the records stay contiguous
+and the whole file maps straight onto RECORD_DTYPE.
+
+    recs = read_log('log/dust_2020-05-17' + SUFFIX)
+    recs['t'], recs['ratio'], recs['level']    # numpy arrays, no copy
+"""
+
+import datetime
+import io
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from . import archive
+
+MAGIC = b'DFLOG\0\0\0'
+VERSION = 1
+SUFFIX = '.dfl'
+BLOCK_RECORDS = 256
+
+# magic, version, record size, records per block, creation time (the
+# time of the file's first reading, so replays write identical files)
+HEADER = struct.Struct('<8sHHId8x')
+# t, ratio, smoothed, level, mode (index into MODES)
+RECORD = struct.Struct('<dffBB6x')
+RECORD_SIZE = RECORD.size
+RECORD_DTYPE = np.dtype({'names':   ['t', 'ratio', 'smoothed', 'level',
+                                     'mode'],
+                         'formats': ['<f8', '<f4', '<f4', 'u1', 'u1'],
+                         'offsets': [0, 8, 12, 16, 17],
+                         'itemsize': RECORD_SIZE})
+MODES = ('Off', 'Low', 'Med', 'High', 'Auto')
+
+_CRC = struct.Struct('<I')
+
+def day_bounds(t):
+    """the local midnights before and after time t"""
+    d = datetime.date.fromtimestamp(t)
+    start = time.mktime(d.timetuple())
+    end = time.mktime((d + datetime.timedelta(days=1)).timetuple())
+    return start, end
+
+class BinaryLog(object):
+    """append readings to daily fixed-record binary files
+
+    The file is switched when a reading falls outside the current day,
+    which is checked against precomputed bounds.  Reopening today's
+    file (after a restart) appends to it, first dropping any partial
+    record left by a crash.
+    """
+
+    def __init__(self, base, fmt='%Y-%m-%d'):
+        self.base = base
+        self.fmt = fmt
+        self.path = None
+        self._bounds = (0.0, 0.0)
+        self._fo = None
+        self._crc_fo = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _rotate(self, t):
+        self.close()
+        self._bounds = day_bounds(t)
+        ext = time.strftime(self.fmt, time.localtime(t))
+        self._open(self.base + ext + SUFFIX, t)
+
+    def _open(self, path, t):
+        self.path = path
+        fo = open(path, 'a+b')
+        size = fo.seek(0, os.SEEK_END)
+        if size < HEADER.size:
+            fo.truncate(0)
+            fo.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE,
+                                 BLOCK_RECORDS, t))
+            size = HEADER.size
+        else:
+            fo.seek(0)
+            read_header(fo)
+        n, extra = divmod(size - HEADER.size, RECORD_SIZE)
+        if extra:
+            fo.truncate(size - extra)
+        # pick up the checksum of a part-filled last block
+        self._nblock = n % BLOCK_RECORDS
+        fo.seek(HEADER.size + (n - self._nblock) * RECORD_SIZE)
+        self._crc = zlib.crc32(fo.read(self._nblock * RECORD_SIZE))
+        fo.seek(0, os.SEEK_END)
+        self._fo = fo
+        self._crc_fo = open(path + '.crc', 'ab')
+        self._crc_fo.truncate((n // BLOCK_RECORDS) * _CRC.size)
+
+    def write(self, t, ratio, smoothed, level, mode):
+        """append one reading; mode is a name from MODES or its index
+        (the core's conf.mode is 'Auto' or a motor level)"""
+        if not self._bounds[0] <= t < self._bounds[1]:
+            self._rotate(t)
+        if isinstance(mode, str): mode = MODES.index(mode)
+        rec = RECORD.pack(t, ratio, smoothed, level, mode)
+        self._fo.write(rec)
+        self._crc = zlib.crc32(rec, self._crc)
+        self._nblock += 1
+        if self._nblock == BLOCK_RECORDS:
+            self._crc_fo.write(_CRC.pack(self._crc))
+            self._crc, self._nblock = 0, 0
+
+    def flush(self):
+        if self._fo is None: return
+        self._fo.flush()
+        self._crc_fo.flush()
+
+    def sync(self):
+        """flush and fsync"""
+        if self._fo is None: return
+        self.flush()
+        os.fsync(self._fo.fileno())
+        os.fsync(self._crc_fo.fileno())
+
+    def close(self):
+        if self._fo is None: return
+        self._fo.close()
+        self._crc_fo.close()
+        self._fo = self._crc_fo = None
+
+def read_header(f):
+    magic, version, rsize, block, created = HEADER.unpack(f.read(HEADER.size))
+    if not (magic == MAGIC and version == VERSION and rsize == RECORD_SIZE):
+        raise ValueError('%s: not a version %d data log'
+                         % (getattr(f, 'name', f), VERSION))
+    return {'block_records': block, 'created': created}
+
+def read_log(path):
+    """map a binary log onto a read-only RECORD_DTYPE array
+
+    A compressed log (see archive) is decompressed into memory.
+    """
+    if archive.is_compressed(path):
+        data = archive.read(path)
+        read_header(io.BytesIO(data))
+        n = (len(data) - HEADER.size) // RECORD_SIZE
+        return np.frombuffer(data, RECORD_DTYPE, n, HEADER.size)
+    with open(path, 'rb') as f:
+        read_header(f)
+        size = f.seek(0, os.SEEK_END)
+    n = (size - HEADER.size) // RECORD_SIZE
+    if n == 0:
+        return np.zeros(0, RECORD_DTYPE)
+    return np.memmap(path, RECORD_DTYPE, 'r', HEADER.size, (n,))
+
+def verify(path):
+    """return the indexes of the completed blocks whose checksums
+    don't match (or are missing)"""
+    recs = read_log(path)
+    try:
+        with open(archive.base(path) + '.crc', 'rb') as f:
+            crcs = f.read()
+    except FileNotFoundError:
+        crcs = b''
+    raw = recs.view(np.uint8)
+    bsize = BLOCK_RECORDS * RECORD_SIZE
+    bad = []
+    for i in range(len(recs) // BLOCK_RECORDS):
+        crc = zlib.crc32(raw[i * bsize:(i + 1) * bsize])
+        off = i * _CRC.size
+        if off + _CRC.size > len(crcs) or \
+           not _CRC.unpack_from(crcs, off)[0] == crc:
+            bad.append(i)
+    return bad
+
+if __name__ == '__main__':
+    import sys
+    for path in sys.argv[1:]:
+        recs = read_log(path)
+        bad = verify(path)
+        print('%s: %d records, %s' % (path, len(recs),
+              'bad blocks %s' % bad if bad else 'ok'))
@@ -0,0 +1,75 @@
+"""reduce a line to about as many points as it has pixels
+
+Past a point or two per pixel, drawing more samples only costs time.
+Both methods pick a subset of the original samples (they return
+indices, so other arrays can be cut down the same way):
+
+  minmax  keeps the lowest and highest sample of each of n/2 equal
+          stretches, so every peak and dip survives; best for noisy
+          raw readings
+  lttb    Largest-Triangle-Three-Buckets: one sample per bucket, the
+          one making the largest triangle with the sample kept from
+          the previous bucket and the mean of the next; keeps the
+          visual shape of smoother lines with fewer points
+
+    x, y = decimate.minmax(x, y, width_in_pixels)
+"""
+
+import numpy as np
+
+def minmax_indices(y, n):
+    """indices of about n samples of y: the min and max of each of n/2
+    equal stretches, in order, plus any leftover tail (a flat stretch
+    gives just one)"""
+    y = np.asarray(y)
+    if len(y) <= n: return np.arange(len(y))
+    b = max(1, n // 2)
+    k = len(y) // b
+    m = b * k
+    yb = y[:m].reshape(b, k)
+    base = np.arange(b) * k
+    lo = base + np.argmin(yb, axis=1)
+    hi = base + np.argmax(yb, axis=1)
+    pairs = np.sort(np.stack((lo, hi), axis=1), axis=1).ravel()
+    pairs = pairs[np.append(True, np.diff(pairs) > 0)]
+    return np.concatenate((pairs, np.arange(m, len(y))))
+
+def lttb_indices(x, y, n):
+    """indices of n samples of (x, y) chosen by Largest-Triangle-Three-
+    Buckets; the first and last samples are always kept (or just the
+    first, for n = 1)"""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    N = len(x)
+    if N <= n: return np.arange(N)
+    if n < 3: return np.array([0, N - 1])[:max(n, 0)]
+    # n - 2 buckets between the fixed first and last samples
+    edges = (np.arange(n - 1) * (N - 2) / (n - 2)).astype(int) + 1
+    edges[-1] = N - 1
+    # mean of each bucket (and of the last sample, after the last one)
+    cx = np.add.reduceat(x[:-1], edges[:-1]) / np.diff(edges)
+    cy = np.add.reduceat(y[:-1], edges[:-1]) / np.diff(edges)
+    cx = np.append(cx[1:], x[-1])
+    cy = np.append(cy[1:], y[-1])
+    out = np.empty(n, dtype=int)
+    out[0], out[-1] = 0, N - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        bx, by = x[lo:hi], y[lo:hi]
+        # twice the triangle areas; the constant factor doesn't matter
+        area = np.abs((x[a] - cx[i]) * (by - y[a]) -
+                      (x[a] - bx) * (cy[i] - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+def minmax(x, y, n):
+    """(x, y) cut down to about n points with minmax_indices"""
+    i = minmax_indices(y, n)
+    return np.asarray(x)[i], np.asarray(y)[i]
+
+def lttb(x, y, n):
+    """(x, y) cut down to n points with lttb_indices"""
+    i = lttb_indices(x, y, n)
+    return np.asarray(x)[i], np.asarray(y)[i]
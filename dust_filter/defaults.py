@@ -0,0 +1,33 @@
+"""the default configuration and the config file search path
+
+Kept apart from core so the command-line tools (sweep, plotdust) can
+read the config without importing the web server and plot stacks.
+"""
+
+DEFAULT_CONFIG = """
+sensor_gpio: 25
+motor_gpios: [21, 26, 20]
+poll: 5 # seconds
+thresholds: [0.02, 0.04, 0.08, 0.16]
+mode: Auto  # Auto, Off, Low, Med, High
+data_prefix: log/dust_
+log_prefix: log/dust.log
+rollup_prefix: log/rollup_ # minute/hour/day summaries
+binary_log: false # also log readings as binary records (data_prefix*.dfl)
+log_flush_records: 12  # commit the data logs every this many readings
+log_flush_interval: 30 # seconds; ... or when the oldest is this old
+log_fsync: false       # fsync the data logs at each commit
+log_compress: gz       # compress closed data logs: gz, xz or none
+log_keep_days: 0       # delete data logs older than this (0: never)
+history_points: 2000   # most rows /api/history returns
+mock: false
+mock_start: 1589722589.97081
+mock_speed: 1.0
+mock_data: []    # data logs to replay in mock mode (default: dustlog.csv)
+mock_loop: true  # repeat the mock data when it runs out
+lazy_plots: true # only render plots while someone is looking at them
+plot_active: 60  # seconds; keep rendering after the last plot request
+plot_max_age: 10 # seconds; re-render an older plot before serving it
+"""
+
+CONFIG_PATH=['/etc/df2000.yaml', './df2000.yaml']
@@ -1,17 +1,83 @@
+import json
 import logging
+import queue
 import threading
+import struct
+import time
 
 
+import numpy as np
 import werkzeug
 import flask
 from flask import Flask, render_template, request, g, abort
 
+from .snapshot import StateSnapshot
+from .mtpw import PipeWrapCaller, RPCError
+from .rollup import WINDOWS
+from .history import History, RESOLUTIONS
+from .metrics import Metrics, render as render_metrics
+
+RPC_TIMEOUT = 5.0 # seconds to wait for the core before giving up
+
 app = Flask(__name__)
 app.config['TEMPLATES_AUTO_RELOAD'] = True
 
+@app.errorhandler(RPCError)
+def rpc_error(e):
+    logging.error('core request failed: %s', e)
+    return 'core unavailable: %s' % e, 503
+
+# the web process's own metrics; requests are handled in threads
+METRICS = Metrics()
+_metrics_lock = threading.Lock()
+
+@app.before_request
+def _start_timer():
+    g.start_time = time.perf_counter()
+
+@app.after_request
+def _count_request(resp):
+    """count the request and time it up to the response being returned
+
+    For a streamed response (/events, /api/export) that is the time to
+    the first byte: the body is generated after this, while it is sent,
+    and isn't included in df_http_request_seconds.
+    """
+    dt = time.perf_counter() - g.start_time
+    endpoint = request.endpoint or 'none'
+    with _metrics_lock:
+        METRICS.counter('df_http_requests_total', endpoint=endpoint,
+                        status=resp.status_code).inc()
+        METRICS.histogram('df_http_request_seconds',
+                          endpoint=endpoint).observe(dt)
+    return resp
+
+def _observe_rpc(meth, seconds):
+    with _metrics_lock:
+        METRICS.histogram('df_rpc_call_seconds', method=meth).observe(seconds)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """counters and latency histograms of the core, plot and web
+    processes, in the Prometheus text format (see metrics)
+
+    If the core doesn't answer, only the web process's metrics are
+    returned.
+    """
+    try:
+        snapshots = dict(PWC.metrics())
+    except RPCError as e:
+        logging.error('failed to get metrics from the core: %s', e)
+        snapshots = {}
+    with _metrics_lock:
+        snapshots['web'] = METRICS.snapshot()
+    return flask.Response(render_metrics(snapshots),
+                          mimetype='text/plain; version=0.0.4')
+
 @app.route('/', methods=['GET'])
 def index():
-    r = PWC.index()
+    r = SNAP.read() if SNAP is not None else None
+    if r is None: r = PWC.index()
     ave_p, thresh_p = _barplot_data(r['average'], r['thresholds'])
 
     fd = dict(labels   = ['Auto', 'High', 'Med', 'Low', 'Off'],
@@ -19,7 +85,8 @@ def index():
               active   = r['active'],
               average  = r['average'],
               ave_p    = ave_p,
-              thresh_p = thresh_p)
+              thresh_p = thresh_p,
+              windows  = list(WINDOWS))
     
     return render_template('index.html',**fd)
 
@@ -29,16 +96,237 @@ def _barplot_data(average, thresholds):
     ap = int(100 * average / pmax)
     return ap, tp
 
+# the last plot fetched from the core: (generation, png data)
+_plot_cache = (None, None)
+# tags plot ETags so generations from an earlier run never match
+_boot = '%x' % int(time.time())
+
 @app.route('/images/plot.png', methods=['GET'])
 def images_plot():
-    data = PWC.image()
-    if data is None:
-        logging.error('failed to get image (not enough data yet?)')
+    """the current plot, with an ETag of its generation
+
+    While the snapshot says the current plot is still fresh, a matching
+    If-None-Match gets a 304 and a plot we already have is re-sent,
+    both without asking the core.  Otherwise the core is asked, which
+    also tells a lazy core that someone is watching.
+
+    ?window=1h, 24h or 7d gets a longer-range plot instead (see
+    rollup.WINDOWS); those always come from the core.
+    """
+    global _plot_cache
+    window = request.args.get('window', '5m')
+    if window not in WINDOWS: abort(404)
+    if not window == '5m': return _window_plot(window)
+    gen, data = _plot_cache
+    s = SNAP.read() if SNAP is not None else None
+    fresh = s is not None and s['plot_gen'] > 0 and \
+        time.time() < s['plot_expires']
+    if fresh and request.if_none_match.contains(_plot_etag(s['plot_gen'])):
+        resp = flask.Response(status=304)
+        gen = s['plot_gen']
+    else:
+        if not (fresh and gen == s['plot_gen']):
+            r = PWC.image()
+            if r is None:
+                logging.error('failed to get image (not enough data yet?)')
+                abort(404)
+            gen, data = _plot_cache = (r['gen'], r['data'])
+        resp = flask.make_response(data)
+        resp.content_type = "image/png"
+    resp.set_etag(_plot_etag(gen))
+    resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
+
+def _window_plot(window):
+    r = PWC.image(window)
+    if r is None:
+        logging.error('failed to get %s image (not enough data yet?)', window)
         abort(404)
-    resp = flask.make_response(data)
+    resp = flask.make_response(r['data'])
     resp.content_type = "image/png"
-    return resp
+    resp.set_etag(_plot_etag(r['gen'], window))
+    resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
+
+def _plot_etag(gen, window='5m'):
+    return '%s-%s-%d' % (_boot, window, gen)
     
+# /api/series binary format (little-endian):
+#   uint8 N, then N float32 thresholds (percent)
+#   then one record per point: float64 t, uint8 level,
+#                              float32 raw (percent), float32 average (percent)
+SERIES_HEADER = struct.Struct('<B')
+SERIES_RECORD = struct.Struct('<dBff')
+
+@app.route('/api/series', methods=['GET'])
+def api_series():
+    """datapoints newer than ?since=<t> for client-side charting
+
+    ?window=1h, 24h or 7d returns rollup buckets covering that window
+    instead of the raw readings.  By default the response is packed
+    binary (see SERIES_RECORD); ?format=json returns the same content
+    as JSON.
+    """
+    since = request.args.get('since', type=float)
+    window = request.args.get('window', '5m')
+    if window not in WINDOWS: abort(404)
+    r = PWC.series(since, window)
+    thp = [ 100 * t for t in r['thresholds'] ]
+    points = [ (t, l, 100 * rr, 100 * ra) for t, l, rr, ra in r['points'] ]
+    if request.args.get('format') == 'json':
+        return flask.jsonify(thresholds=thp, points=points)
+
+    buf = bytearray(SERIES_HEADER.size + 4 * len(thp) +
+                    SERIES_RECORD.size * len(points))
+    SERIES_HEADER.pack_into(buf, 0, len(thp))
+    struct.pack_into('<%df' % len(thp), buf, SERIES_HEADER.size, *thp)
+    offset = SERIES_HEADER.size + 4 * len(thp)
+    for p in points:
+        SERIES_RECORD.pack_into(buf, offset, *p)
+        offset += SERIES_RECORD.size
+    resp = flask.make_response(bytes(buf))
+    resp.content_type = 'application/octet-stream'
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+# the core's data and rollup file names and history settings, fetched
+# on first use; each request reads through a History of its own, so
+# requests don't wait for each other (the CSV indexes are shared on disk)
+_history_conf = None
+_history_lock = threading.Lock()
+
+def _history():
+    """a new History over the core's files, and the settings"""
+    global _history_conf
+    with _history_lock:
+        if _history_conf is None:
+            _history_conf = PWC.history_conf()
+        conf = _history_conf
+    return History(conf['data_prefix'], conf['rollup_prefix']), conf
+
+@app.route('/api/history', methods=['GET'])
+def api_history():
+    """past readings, read from the data log and rollup files in this
+    process (the core only supplies the file names, once)
+
+      ?start=, ?end=   unix times (default: the hour up to now)
+      ?resolution=     raw, minute, hour or day: the finest wanted
+                       (default raw); a coarser one is used if needed
+                       to stay within the history_points budget
+      ?format=bin      packed little-endian records instead of JSON:
+                       history.RAW_DTYPE (t, ratio, level) for raw,
+                       otherwise rollup.RECORD; the resolution and the
+                       field names are in X-Resolution and X-Fields
+
+    The JSON is column-wise: {resolution, start, end, columns: {field:
+    [values]}}.  Ratios are unscaled (not percent), and the rollup
+    buckets come from the files, so the bucket in progress is missing.
+    """
+    end = request.args.get('end', type=float)
+    if end is None: end = time.time()
+    start = request.args.get('start', type=float)
+    if start is None: start = end - 3600
+    resolution = request.args.get('resolution', 'raw')
+    if resolution not in RESOLUTIONS or not start < end:
+        abort(400)
+    h, conf = _history()
+    try:
+        res, rows = h.query(start, end, conf['points'], resolution,
+                            conf['poll'])
+    except ValueError as e:
+        return str(e), 400
+
+    if request.args.get('format') == 'bin':
+        resp = flask.make_response(rows.tobytes())
+        resp.content_type = 'application/octet-stream'
+        resp.headers['X-Resolution'] = res
+        resp.headers['X-Fields'] = ','.join(rows.dtype.names)
+        return resp
+    columns = {}
+    for name in rows.dtype.names:
+        col = rows[name]
+        if col.dtype == np.float32:
+            # float32 -> shortest decimal that reads back the same
+            columns[name] = [ float(np.format_float_positional(v))
+                              for v in col.ravel() ]
+            if col.ndim > 1:
+                n = col.shape[1]
+                columns[name] = [ columns[name][i:i+n]
+                                  for i in range(0, len(columns[name]), n) ]
+        else:
+            columns[name] = col.tolist()
+    body = json.dumps({'resolution': res, 'start': start, 'end': end,
+                       'columns': columns}, separators=(',', ':'))
+    return flask.Response(body, mimetype='application/json')
+
+EXPORT_CHUNK = 3600 # seconds of readings read and sent at a time
+
+@app.route('/api/export', methods=['GET'])
+def api_export():
+    """stream the raw readings (t, ratio, level) for a range as CSV
+    (the default) or, with ?format=ndjson, one JSON object per line
+
+      ?start=, ?end=   unix times (default: the day up to now)
+
+    The range is read EXPORT_CHUNK seconds at a time through a History
+    of its own, so memory use doesn't depend on the length of the range
+    and other requests aren't held up.  Times and ratios are written as
+    repr() does, so they read back exactly as they are in the log.
+    """
+    end = request.args.get('end', type=float)
+    if end is None: end = time.time()
+    start = request.args.get('start', type=float)
+    if start is None: start = end - 86400
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson') or not start < end:
+        abort(400)
+    h, conf = _history()
+    if fmt == 'csv':
+        header, row = 't,ratio,level\n', '%r,%r,%d\n'
+    else:
+        header, row = '', '{"t":%r,"ratio":%r,"level":%d}\n'
+
+    def stream():
+        yield header
+        t0 = start
+        while t0 < end:
+            t1 = min(t0 + EXPORT_CHUNK, end)
+            t, r, level = h.range(t0, t1)
+            if len(t):
+                yield ''.join([ row % x for x in
+                                zip(t.tolist(), r.tolist(), level.tolist()) ])
+            t0 = t1
+
+    name = 'dust_%s_%s.%s' % (time.strftime('%Y%m%d-%H%M%S',
+                                            time.localtime(start)),
+                              time.strftime('%Y%m%d-%H%M%S',
+                                            time.localtime(end)), fmt)
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    resp = flask.Response(stream(), mimetype=mimetype)
+    resp.headers['Content-Disposition'] = 'attachment; filename=%s' % name
+    return resp
+
+@app.route('/events', methods=['GET'])
+def events():
+    """Server-Sent Events stream of readings, level, mode and settings
+    changes as they are published by the core"""
+    if HUB is None: abort(404)
+    q = HUB.subscribe()
+    def stream():
+        try:
+            while True:
+                try:
+                    msg = q.get(timeout=EventHub.KEEPALIVE)
+                except queue.Empty:
+                    msg = ': keepalive\n\n'
+                if msg is None: break
+                yield msg
+        finally:
+            HUB.unsubscribe(q)
+    resp = flask.Response(stream(), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
 @app.route('/mode', methods=['POST'])
 def mode():
     logging.info('POST mode: %s', request.form)
@@ -47,18 +335,21 @@ def mode():
 
 @app.route('/settings', methods=['GET', 'POST'])
 def settings():
+    """the thresholds form, with the current average and active level
+    (fetched from the core along with the settings, in one round trip;
+    after a POST, the level the new thresholds give)"""
     if request.method == 'GET':
         logging.info('GET settings')
-        settings = PWC.settings()
-        return render_template('settings.html', **settings)
+        settings, r = PWC.batch(('settings',), ('index',))
     else: # POST
         logging.info('POST settings: %s', request.form)
         f = request.form
         thresholds = [ float(f[k]) for k in ('t1', 't2', 't3', 't4') ]
         settings = {'thresholds': thresholds}
         
-        settings = PWC.settings(settings)
-        return render_template('settings.html', **settings)
+        settings, r = PWC.batch(('settings', (settings,)), ('index',))
+    return render_template('settings.html', average=r['average'],
+                           active=r['active'], **settings)
         
 
 
@@ -80,34 +371,92 @@ class _dummyDFObj(object):
 
 ################################################################
 
-class PipeWrapCaller(object):
-    def __init__(self, pipe):
+class EventHub(object):
+    """fan events from the core out to any number of SSE subscribers
+
+    The core sends each event once over a one-way pipe.  A reader
+    thread formats it and puts it on every subscriber's queue.  A new
+    subscriber is first sent the latest reading and the latest state
+    (level, mode or settings event, which all carry the full state).  A
+    subscriber that falls QUEUE_SIZE events behind is dropped (its
+    stream ends and the browser reconnects).
+    """
+    QUEUE_SIZE = 100
+    KEEPALIVE = 15.0 # seconds
+
+    def __init__(self, conn):
+        self.conn = conn
         self.lock = threading.Lock()
-        logging.debug('initiating PipeWrapCaller')
-        self.pipe = pipe
-    def __getattr__(self, attr):
-        logging.debug('PipeWrapCaller getting: %s', attr)
-        def _lambda(*args, **kwargs):
-            logging.debug('PipeWrapCaller (%s, %s, %s)', attr, args, kwargs)
+        self.subscribers = set()
+        self.latest = {}
+
+    def start(self):
+        t = threading.Thread(target=self._run, name='events', daemon=True)
+        t.start()
+
+    def _run(self):
+        while True:
+            try:
+                event, data = self.conn.recv()
+            except EOFError:
+                logging.error('event pipe from core closed')
+                break
+            msg = 'event: %s\ndata: %s\n\n' % (event, json.dumps(data))
             with self.lock:
-                self.pipe.send( (attr, args, kwargs) )
-                ret = self.pipe.recv()
-            logging.debug('PipeWrapCaller %s --> %10.10s...', attr, ret)
-            return ret
-        return _lambda
+                key = 'reading' if event == 'reading' else 'state'
+                self.latest[key] = msg
+                for q in list(self.subscribers):
+                    try:
+                        q.put_nowait(msg)
+                    except queue.Full:
+                        logging.warning('dropping slow event subscriber')
+                        self._drop(q)
+
+    def _drop(self, q):
+        self.subscribers.discard(q)
+        try:
+            while True: q.get_nowait()
+        except queue.Empty:
+            pass
+        q.put_nowait(None)
+
+    def subscribe(self):
+        q = queue.Queue(self.QUEUE_SIZE)
+        with self.lock:
+            for msg in self.latest.values():
+                q.put_nowait(msg)
+            self.subscribers.add(q)
+        logging.debug('event subscriber added (%d total)',
+                      len(self.subscribers))
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.discard(q)
+        logging.debug('event subscriber removed (%d total)',
+                      len(self.subscribers))
+
+HUB = None
+SNAP = None
 
-def main(logq, pipe):
+def main(logq, pipe, events=None, snapshot=None):
     h = logging.handlers.QueueHandler(logq)
     root = logging.getLogger()
     root.addHandler(h)
     root.setLevel(logging.DEBUG)
 
     logging.info('starting web server')
-    global PWC
-    PWC = PipeWrapCaller(pipe)
+    global PWC, HUB, SNAP
+    PWC = PipeWrapCaller(pipe, RPC_TIMEOUT)
+    PWC.observe = _observe_rpc
+    if snapshot is not None:
+        SNAP = StateSnapshot(snapshot)
+    if events is not None:
+        HUB = EventHub(events)
+        HUB.start()
     #if werkzeug.serving.is_running_from_reloader():
     #    logging.info('flask running in reloader')
-    app.run(debug=False, host="0.0.0.0")
+    app.run(debug=False, host="0.0.0.0", threaded=True)
 
 if __name__ == '__main__':
     pass
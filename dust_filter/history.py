@@ -0,0 +1,253 @@
+"""read time ranges out of the daily data logs
+
+The core writes one CSV file a day, data_prefix + '%Y-%m-%d' (and, with
+binary_log, a matching datalog.SUFFIX file).  History finds the files
+that can hold a [start, end) range from their dates alone, and reads
+just that part of each:
+
+  - binary logs are memory-mapped and binary-searched directly
+  - CSV logs get a sidecar index (<file>.idx) holding the timestamp
+    and byte offset of every INDEX_EVERY-th row; the range is found by
+    binary-searching the index, and only the rows between the two
+    bracketing offsets are parsed
+
+The index is built on first use and extended as the file grows.
+Compressed logs (see archive) are read transparently: the day is
+decompressed into memory (the last one is kept) and the index, which
+describes the uncompressed content, is used the same way.
+
+Given the rollup prefix too, query() picks the finest resolution - the
+raw readings or a rollup tier - that covers a range within a point
+budget.
+
+    h = History('log/dust_')
+    t, r, level = h.range(start, end)
+"""
+
+import datetime
+import io
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from . import archive
+from . import datalog
+from . import rollup
+
+DATEFMT = '%Y-%m-%d'
+INDEX_EVERY = 256 # rows between CSV index entries
+INDEX_SUFFIX = '.idx'
+INDEX_DTYPE = np.dtype([('t', '<f8'), ('offset', '<u8')])
+# query() results at the raw resolution
+RAW_DTYPE = np.dtype([('t', '<f8'), ('ratio', '<f4'), ('level', 'u1')])
+RESOLUTIONS = ('raw',) + tuple(name for name, w, r in rollup.Rollup.TIERS)
+
+def _empty():
+    return np.zeros(0), np.zeros(0), np.zeros(0, np.int8)
+
+class History(object):
+    def __init__(self, prefix, rollup_prefix=None, every=INDEX_EVERY):
+        self.prefix = prefix
+        self.rollup_prefix = rollup_prefix
+        self.every = every
+        self._indexes = {} # path -> (file size, index, indexed size)
+        self._day = (None, None) # last decompressed (path, data)
+
+    def days(self, start, end):
+        """the dates (local time) that [start, end) touches"""
+        d = datetime.date.fromtimestamp(start)
+        last = datetime.date.fromtimestamp(max(start, end - 1e-6))
+        days = []
+        while d <= last:
+            days.append(d)
+            d += datetime.timedelta(days=1)
+        return days
+
+    def files(self, start, end):
+        """the existing log files that can hold readings in
+        [start, end): for each day, the binary log if it starts no
+        later than the CSV log (binary_log may have been switched on
+        partway through the day), otherwise the CSV log"""
+        files = []
+        for d in self.days(start, end):
+            fn = self.prefix + d.strftime(DATEFMT)
+            csv, binary = archive.find(fn), archive.find(fn + datalog.SUFFIX)
+            if binary is not None and (csv is None or
+                                       self._covers(binary, csv)):
+                files.append(binary)
+            elif csv is not None:
+                files.append(csv)
+        return files
+
+    def _covers(self, binary, csv):
+        """True if the binary log's first reading is no later than the
+        CSV log's"""
+        try:
+            with archive.open_log(binary) as f:
+                datalog.read_header(f)
+                rec = f.read(datalog.RECORD_SIZE)
+            with archive.open_log(csv) as f:
+                row = f.readline()
+            if not row.endswith(b'\n'): return True # nothing in the CSV
+            if not len(rec) == datalog.RECORD_SIZE: return False
+            return datalog.RECORD.unpack(rec)[0] <= float(row.split(b',')[0])
+        except (OSError, ValueError):
+            logging.exception('comparing %s with %s', binary, csv)
+            return False
+
+    def range(self, start, end):
+        """return (t, r, level) arrays of the readings in [start, end)"""
+        parts = []
+        for fn in self.files(start, end):
+            try:
+                try:
+                    parts.append(self._read(fn, start, end))
+                except FileNotFoundError:
+                    # compressed by the archiver since files() found it
+                    found = archive.find(archive.base(fn))
+                    if found is None or found == fn: raise
+                    parts.append(self._read(found, start, end))
+            except (OSError, ValueError):
+                logging.exception('skipping unreadable log file %s', fn)
+        parts = [ p for p in parts if len(p[0]) ]
+        if not parts: return _empty()
+        return tuple(np.concatenate(a) for a in zip(*parts))
+
+    def query(self, start, end, budget, resolution='raw', poll=5):
+        """return (resolution, rows) for [start, end): the finest
+        resolution no finer than the one asked for that needs at most
+        budget rows.  rows is a RAW_DTYPE array of readings or a
+        rollup.RECORD_DTYPE array of buckets.  poll is the expected
+        seconds between readings.
+
+        Raises ValueError if even the coarsest tier is over budget.
+        """
+        widths = dict( (name, w) for name, w, r in rollup.Rollup.TIERS )
+        widths['raw'] = poll
+        for res in RESOLUTIONS[RESOLUTIONS.index(resolution):]:
+            if (end - start) / widths[res] >= budget: continue
+            if res == 'raw':
+                t, r, level = self.range(start, end)
+                if len(t) > budget: continue
+                rows = np.zeros(len(t), RAW_DTYPE)
+                rows['t'], rows['ratio'], rows['level'] = t, r, level
+                return res, rows
+            if self.rollup_prefix is None: break
+            return res, rollup.read_tier(
+                '%s%s.dat' % (self.rollup_prefix, res),
+                rollup.bucket_bounds(start, widths[res])[0], end)
+        raise ValueError('no resolution covers %g seconds in %d points'
+                         % (end - start, budget))
+
+    def _read(self, fn, start, end):
+        if archive.base(fn).endswith(datalog.SUFFIX):
+            return self._read_binary(fn, start, end)
+        return self._read_csv(fn, start, end)
+
+    def _read_binary(self, fn, start, end):
+        recs = datalog.read_log(fn)
+        i, j = np.searchsorted(recs['t'], (start, end))
+        recs = recs[i:j]
+        return (np.array(recs['t']), recs['ratio'].astype(float),
+                recs['level'].astype(np.int8))
+
+    def _read_csv(self, fn, start, end):
+        if archive.is_compressed(fn):
+            if not self._day[0] == fn:
+                self._day = (fn, archive.read(fn))
+            return self._read_csv_data(archive.base(fn), start, end,
+                                       self._day[1])
+        return self._read_csv_data(fn, start, end)
+
+    def _read_csv_data(self, fn, start, end, contents=None):
+        idx, size = self.index(fn, contents)
+        lo = np.searchsorted(idx['t'], start, 'right') - 1
+        hi = np.searchsorted(idx['t'], end, 'left')
+        lo = int(idx['offset'][lo]) if lo >= 0 else 0
+        hi = int(idx['offset'][hi]) if hi < len(idx) else size
+        if contents is not None:
+            data = contents[lo:hi]
+        else:
+            with open(fn, 'rb') as f:
+                f.seek(lo)
+                data = f.read(hi - lo)
+        if not data: return _empty()
+        a = np.loadtxt(io.BytesIO(data), delimiter=',', ndmin=2,
+                       usecols=(0, 1, 2))
+        t = a[:, 0]
+        keep = (t >= start) & (t < end)
+        return t[keep], a[keep, 1], a[keep, 2].astype(np.int8)
+
+    def index(self, fn, contents=None):
+        """return the (index, size) of a CSV log: index entries for
+        every self.every-th complete row in the first size bytes
+
+        For a compressed log, fn is the uncompressed name and contents
+        the decompressed data.
+        """
+        size = os.path.getsize(fn) if contents is None else len(contents)
+        cached = self._indexes.get(fn)
+        if cached is not None and cached[0] == size:
+            return cached[1], cached[2]
+        idx = self._load_index(fn, size)
+        # rescan from the last entry; everything before it is indexed
+        off = int(idx['offset'][-1]) if len(idx) else 0
+        if contents is not None:
+            data = contents[off:]
+        else:
+            with open(fn, 'rb') as f:
+                f.seek(off)
+                data = f.read()
+        end = data.rfind(b'\n') + 1 # only complete rows
+        new = self._scan(data[:end], off)
+        if len(idx): new = new[1:] # the last entry is found again
+        if len(new):
+            idx = np.concatenate((idx, new))
+            self._save_index(fn, idx)
+        self._indexes[fn] = (size, idx, off + end)
+        return idx, off + end
+
+    def _scan(self, data, base):
+        nl = np.flatnonzero(np.frombuffer(data, np.uint8) == ord('\n'))
+        if len(nl):
+            starts = np.concatenate(([0], nl[:-1] + 1))[::self.every]
+        else:
+            starts = nl
+        new = np.zeros(len(starts), INDEX_DTYPE)
+        new['offset'] = starts + base
+        for i, s in enumerate(starts):
+            new['t'][i] = float(data[s:data.index(b',', s)])
+        return new
+
+    def _load_index(self, fn, size):
+        path = fn + INDEX_SUFFIX
+        try:
+            idx = np.fromfile(path, INDEX_DTYPE)
+        except (FileNotFoundError, ValueError):
+            return np.zeros(0, INDEX_DTYPE)
+        # drop entries past the end (the log was replaced or truncated),
+        # on disk too, or they'd be trusted again once it grows past them
+        keep = idx['offset'] < size
+        if not keep.all():
+            idx = idx[keep]
+            self._save_index(fn, idx)
+        return idx
+
+    def _save_index(self, fn, idx):
+        # a temporary file per thread: web requests may index at once
+        tmp = '%s%s.%d.tmp' % (fn, INDEX_SUFFIX, threading.get_ident())
+        idx.tofile(tmp)
+        os.replace(tmp, fn + INDEX_SUFFIX)
+
+if __name__ == '__main__':
+    import sys
+    h = History(sys.argv[1])
+    end = time.time() if len(sys.argv) < 4 else float(sys.argv[3])
+    start = end - 600 if len(sys.argv) < 3 else float(sys.argv[2])
+    t0 = time.perf_counter()
+    t, r, level = h.range(start, end)
+    print('%d readings in %.1f ms'
+          % (len(t), 1000 * (time.perf_counter() - t0)))
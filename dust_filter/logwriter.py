@@ -0,0 +1,190 @@
+"""write the data logs from a background thread
+
+The control loop hands each reading to LogWriter.put(), which never
+blocks: the reading goes on a bounded queue (or is dropped and counted
+if the queue is full; with block, it waits for room instead, which is
+what a replay wants).  A writer thread drains the queue into the logs
+and group-commits them: the files are flushed (and optionally fsynced)
+once flush_records readings are waiting or flush_interval seconds have
+passed since the first of them, not after every reading.
+
+A log is any object with write(t, ratio, smoothed, level, mode),
+flush(), sync() and close(): DailyCSV, or datalog.BinaryLog.  When the
+readings move into a new day, the logs are committed and
+on_rotate(t) is called (the core uses it to archive the closed day).
+"""
+
+import csv
+import logging
+import os
+import queue
+import threading
+import time
+
+from .datalog import day_bounds
+
+class DailyCSV(object):
+    """the CSV data log: t, ratio, level rows in one file per day
+    (base + strftime(fmt)), switched when a reading falls outside the
+    current day"""
+
+    def __init__(self, base, fmt='%Y-%m-%d'):
+        self.base = base
+        self.fmt = fmt
+        self._bounds = (0.0, 0.0)
+        self._fo = None
+        self._writer = None
+
+    def _rotate(self, t):
+        self.close()
+        self._bounds = day_bounds(t)
+        ext = time.strftime(self.fmt, time.localtime(t))
+        self._fo = open(self.base + ext, 'a', newline='')
+        self._writer = csv.writer(self._fo)
+
+    def write(self, t, ratio, smoothed, level, mode):
+        if not self._bounds[0] <= t < self._bounds[1]:
+            self._rotate(t)
+        self._writer.writerow( (t, ratio, level) )
+
+    def flush(self):
+        if self._fo is not None: self._fo.flush()
+
+    def sync(self):
+        if self._fo is None: return
+        self._fo.flush()
+        os.fsync(self._fo.fileno())
+
+    def close(self):
+        if self._fo is None: return
+        self._fo.close()
+        self._fo = self._writer = None
+
+class LogWriter(object):
+    """group-committing background writer for the data logs
+
+    stats() reports the queue depth, readings written and dropped, and
+    the latency from put() until the reading was committed (flushed).
+    A summary is logged every REPORT_INTERVAL seconds.
+    """
+
+    REPORT_INTERVAL = 3600 # seconds
+    SLOW_COMMIT = 1.0      # seconds; warn about commits slower than this
+
+    def __init__(self, logs, queue_size=1000, flush_records=12,
+                 flush_interval=30.0, fsync=False, on_rotate=None,
+                 block=False):
+        self.logs = logs
+        self.block = block
+        self.on_rotate = on_rotate
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.q = queue.Queue(queue_size)
+        self.lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.commits = 0
+        self.latency_max = 0.0   # seconds
+        self.latency_sum = 0.0
+        self.commit_time = 0.0   # seconds spent in the last commit
+        self._thread = threading.Thread(target=self._run, name='logwriter',
+                                        daemon=True)
+        self._thread.start()
+
+    def put(self, t, ratio, smoothed, level, mode):
+        """queue a reading; never blocks unless self.block"""
+        try:
+            self.q.put( (time.monotonic(), (t, ratio, smoothed, level, mode)),
+                        self.block )
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+                dropped = self.dropped
+            if dropped == 1 or dropped % 100 == 0:
+                logging.error('data log queue full, %d readings dropped',
+                              dropped)
+
+    def stats(self):
+        with self.lock:
+            n = self.written
+            return {'queue': self.q.qsize(),
+                    'written': n,
+                    'dropped': self.dropped,
+                    'commits': self.commits,
+                    'latency_mean': self.latency_sum / n if n else 0.0,
+                    'latency_max': self.latency_max,
+                    'commit_time': self.commit_time}
+
+    def close(self):
+        """commit everything queued and stop the thread"""
+        self.q.put(None)
+        self._thread.join()
+        for log in self.logs:
+            log.close()
+
+    def _run(self):
+        pending = []  # enqueue times of written but uncommitted readings
+        deadline = None
+        bounds = (0.0, 0.0) # the day being written
+        rotated = None
+        next_report = time.monotonic() + self.REPORT_INTERVAL
+        while True:
+            timeout = None if deadline is None else \
+                max(0.0, deadline - time.monotonic())
+            try:
+                item = self.q.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                self._commit(pending)
+                return
+            if item:
+                enq, rec = item
+                if not bounds[0] <= rec[0] < bounds[1]:
+                    bounds = day_bounds(rec[0])
+                    rotated = rec[0]
+                try:
+                    for log in self.logs:
+                        log.write(*rec)
+                except Exception:
+                    logging.exception('data log write failed')
+                pending.append(enq)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if pending and (len(pending) >= self.flush_records or
+                            rotated is not None or
+                            time.monotonic() >= deadline):
+                self._commit(pending)
+                pending, deadline = [], None
+            if rotated is not None:
+                if self.on_rotate is not None:
+                    try:
+                        self.on_rotate(rotated)
+                    except Exception:
+                        logging.exception('data log on_rotate failed')
+                rotated = None
+            if time.monotonic() >= next_report:
+                logging.info('data log: %s', self.stats())
+                next_report += self.REPORT_INTERVAL
+
+    def _commit(self, pending):
+        if not pending: return
+        t0 = time.monotonic()
+        try:
+            for log in self.logs:
+                if self.fsync: log.sync()
+                else:          log.flush()
+        except Exception:
+            logging.exception('data log flush failed')
+        now = time.monotonic()
+        if now - t0 > self.SLOW_COMMIT:
+            logging.warning('data log commit of %d readings took %.1f s',
+                            len(pending), now - t0)
+        with self.lock:
+            self.commits += 1
+            self.written += len(pending)
+            self.commit_time = now - t0
+            for enq in pending:
+                self.latency_sum += now - enq
+                self.latency_max = max(self.latency_max, now - enq)
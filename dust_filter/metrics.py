@@ -0,0 +1,165 @@
+"""counters and latency histograms, exported as Prometheus text
+
+Each process (core, plot, web) keeps its own Metrics.  The hot paths
+hold on to the Counter and Histogram objects they update, so recording
+is an addition or a bisect into a short list of bucket bounds - cheap
+enough to do for every stage of every reading.
+
+snapshot() turns a Metrics into plain tuples that can be pickled to
+another process; the web process collects the snapshots of all three
+and render() writes them in the Prometheus text exposition format:
+
+    df_stage_seconds_bucket{process="core",stage="sensor_read",le="0.001"} 17
+    ...
+    df_motor_transitions_total{process="core"} 3
+
+Updates aren't locked.  The core and plot processes update their
+metrics from one thread; the web process takes a lock around its own.
+"""
+
+import bisect
+import collections
+
+# upper bounds (seconds) of the latency buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name -> (type, help) for every metric the processes record
+DESCRIPTIONS = collections.OrderedDict([
+    ('df_stage_seconds', ('histogram',
+        'time spent in each stage of the control loop')),
+    ('df_schedule_lateness_seconds', ('histogram',
+        'how late each reading was taken after its scheduled time')),
+    ('df_readings_total', ('counter', 'sensor readings taken')),
+    ('df_high_readings_suppressed_total', ('counter',
+        'readings over the limit, replaced by the previous reading')),
+    ('df_motor_transitions_total', ('counter', 'motor speed changes')),
+    ('df_rpc_requests_total', ('counter',
+        'requests from the web process handled by the core')),
+    ('df_rpc_errors_total', ('counter',
+        'requests from the web process that failed')),
+    ('df_plot_renders_total', ('counter',
+        'plots received from the plot process')),
+    ('df_datalog_queue', ('gauge', 'readings waiting for the log writer')),
+    ('df_datalog_written_total', ('counter', 'readings committed to the '
+        'data logs')),
+    ('df_datalog_dropped_total', ('counter',
+        'readings dropped because the log writer queue was full')),
+    ('df_plot_messages_total', ('counter',
+        'plot messages received by the plot process')),
+    ('df_plot_render_seconds', ('histogram', 'time to render a plot')),
+    ('df_http_requests_total', ('counter', 'HTTP requests served')),
+    ('df_http_request_seconds', ('histogram',
+        'time to handle an HTTP request (to the start of the response)')),
+    ('df_rpc_call_seconds', ('histogram',
+        'round trip time of requests to the core')),
+    ])
+
+class Counter(object):
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+class Gauge(object):
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, v):
+        self.value = v
+
+class Histogram(object):
+    """counts of observations at or below each bound, plus the sum"""
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # the last is +Inf
+        self.sum = 0.0
+
+    def observe(self, v):
+        self.counts[bisect.bisect_left(self.bounds, v)] += 1
+        self.sum += v
+
+class Metrics(object):
+    """the metrics of one process, by (name, labels)"""
+
+    def __init__(self):
+        self._metrics = collections.OrderedDict()
+
+    def _get(self, cls, name, labels, *args):
+        if name not in DESCRIPTIONS:
+            raise KeyError('undescribed metric %s' % name)
+        key = (name, tuple(sorted(labels.items())))
+        m = self._metrics.get(key)
+        if m is None:
+            m = self._metrics[key] = cls(*args)
+        return m
+
+    def counter(self, name, **labels):
+        return self._get(Counter, name, labels)
+
+    def gauge(self, name, **labels):
+        return self._get(Gauge, name, labels)
+
+    def histogram(self, name, bounds=LATENCY_BUCKETS, **labels):
+        return self._get(Histogram, name, labels, bounds)
+
+    def snapshot(self):
+        """[(name, labels, value)], where a histogram's value is
+        (bounds, counts, sum)"""
+        snap = []
+        for (name, labels), m in list(self._metrics.items()):
+            if isinstance(m, Histogram):
+                value = (m.bounds, list(m.counts), m.sum)
+            else:
+                value = m.value
+            snap.append( (name, labels, value) )
+        return snap
+
+def _escape(v):
+    return (str(v).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+def _labels(labels, **extra):
+    items = list(labels) + sorted(extra.items())
+    if not items: return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, _escape(v)) for k, v in items)
+
+def _number(v):
+    if v == float('inf'): return '+Inf'
+    return repr(v) if isinstance(v, float) else str(v)
+
+def render(snapshots):
+    """the Prometheus text for {process: snapshot}"""
+    families = collections.OrderedDict( (name, []) for name in DESCRIPTIONS )
+    for process, snap in snapshots.items():
+        for name, labels, value in snap:
+            families[name].append( ((('process', process),) + labels,
+                                    value) )
+    lines = []
+    for name, samples in families.items():
+        if not samples: continue
+        kind, text = DESCRIPTIONS[name]
+        lines.append('# HELP %s %s' % (name, text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for labels, value in samples:
+            if not kind == 'histogram':
+                lines.append('%s%s %s' % (name, _labels(labels),
+                                          _number(value)))
+                continue
+            bounds, counts, total = value
+            n = 0
+            for le, c in zip(tuple(bounds) + (float('inf'),), counts):
+                n += c
+                lines.append('%s_bucket%s %d' % (name,
+                             _labels(labels, le=_number(float(le))), n))
+            lines.append('%s_sum%s %s' % (name, _labels(labels),
+                                          _number(total)))
+            lines.append('%s_count%s %d' % (name, _labels(labels), n))
+    return '\n'.join(lines) + '\n'
@@ -1,6 +1,11 @@
+import io
 import pathlib
 import time
-import csv
+
+import numpy as np
+
+from . import archive
+from . import datalog
 
 class MockPi(object):
     def __init__(self):
@@ -11,32 +16,59 @@ class MockPi(object):
         self.gpios[gpio] = val
 
 class FileInterpolator(object):
-    def __init__(self, fn):
-        #print('opening %s' % fn)
-        self.fo = open(fn)
-        self.lines = csv.reader(self.fo, delimiter=',')
-        self.t1, self.v1, _ = map(float, next(self.lines))
-        self.t2, self.v2, _ = map(float, next(self.lines))
+    """interpolate readings from one or more data logs
+
+    The files (CSV or binary data logs, compressed or not) are loaded
+    into arrays and joined in time order; get(t) is a binary search
+    and a linear interpolation, whatever t is.  With loop, times past
+    the end wrap around to the start, so the data repeats forever;
+    otherwise they get the first or last reading.
+    """
+
+    def __init__(self, fns, loop=True):
+        if isinstance(fns, (str, pathlib.Path)): fns = [fns]
+        ts, vs = [], []
+        for fn in fns:
+            t, v = self._load(str(fn))
+            ts.append(t)
+            vs.append(v)
+        t, v = np.concatenate(ts), np.concatenate(vs)
+        order = np.argsort(t, kind='stable')
+        self.t, self.v = t[order], v[order]
+        if len(self.t) < 2:
+            raise ValueError('need at least two readings in %s' % fns)
+        self.loop = loop
+        # one typical sample interval past the last reading
+        self.period = self.t[-1] - self.t[0] + np.median(np.diff(self.t))
+
+    def _load(self, fn):
+        if archive.base(fn).endswith(datalog.SUFFIX):
+            recs = datalog.read_log(fn)
+            return np.array(recs['t']), recs['ratio'].astype(float)
+        data = np.loadtxt(io.BytesIO(archive.read(fn)), delimiter=',',
+                          ndmin=2, usecols=(0, 1))
+        return data[:, 0], data[:, 1]
+
+    def seek(self, t):
+        """index of the first reading at or after t (O(log n))"""
+        return int(np.searchsorted(self.t, self._wrap(t)))
+
+    def _wrap(self, t):
+        if not self.loop: return t
+        return self.t[0] + (t - self.t[0]) % self.period
 
     def get(self, t):
-        #print(t)
-        while t > self.t2:
-            self.t1, self.v1,   = self.t2, self.v2
-            self.t2, self.v2, _ = map(float, next(self.lines))
-        v = self.v1 + (self.v2 - self.v1) * \
-            (t - self.t1) / (self.t2 - self.t1)
-        #print('1:  %10f %10f' % (self.t1, self.v1))
-        #print('2:  %10f %10f' % (self.t2, self.v2))
-        #print('    %10f %10f' % (t, v))
-        return v
+        return float(np.interp(self._wrap(t), self.t, self.v))
 
 class MockSensor(object):
-    def __init__(self, timefunc, datafile=None):
+    def __init__(self, timefunc, datafile=None, loop=True):
+        """datafile is a data log or a list of them (default: the
+        bundled dustlog.csv)"""
         self._time = timefunc
-        if datafile is None:
+        if not datafile:
             datafile = pathlib.Path(__file__).parent.joinpath('dustlog.csv')
         self.datafile = datafile
-        self.fi = FileInterpolator(self.datafile)
+        self.fi = FileInterpolator(self.datafile, loop)
         
     def read(self):
         return self.fi.get(self._time())
@@ -2,14 +2,16 @@ import logging
 import time
 
 class Motor(object):
-    def __init__(self, pi, gpios=None, limit=1):
+    def __init__(self, pi, gpios=None, limit=1, timefunc=time.time):
         self.pi = pi
         self.gpios = gpios
         self.limit = limit
+        self._time = timefunc
         self._last = 0
+        self.transitions = 0 # speed changes made
 
     def set(self, val):
-        now = time.time()
+        now = self._time()
         diff = now - self._last
         self._last = now
 
@@ -39,6 +41,7 @@ class Motor(object):
             self.pi.write(self.gpios[old_val-1], 0)
         if val: # if we need to turn something on, do that
             self.pi.write(self.gpios[val-1], 1)
+        self.transitions += 1
 
     def get(self):
         state = [ self.pi.read(g) for g in self.gpios ]
@@ -1,48 +1,195 @@
-class multiprocessing
-
-
-class FWrap(object):
-    def __init__(self, func):
-        self.func = func
-        self.cp, self.pp = self.pipe = multiprocessing.Pipe()
-        self.clock = multiprocssing.Lock()
-        self.rlock = multiprocssing.Lock()
-        self.proc = multiprocessing.Process(target=self.watch_loop)
-        self.proc.start()
-
-    def call_wait(self, *args, **kwargs):
-        with self.clock:
-            print('parent writing to pipe')
-            self.pp.send(args, kwargs)
-            print('parent waiting for response')
-
-        resp = self.pp.recv()
-        print('parent got response')
-        return resp
-            
-    def watch_loop(self):
+"""multi-threaded pipe wrapper: RPC between the core and the web server
+
+Every request carries an id, so any number of threads can have calls
+in flight over one multiprocessing connection at the same time; the
+replies are matched back up by id.
+
+    request:  (rid, meth, args, kwargs)
+    reply:    (rid, ok, result)      result is the exception text if not ok
+
+A request whose meth is BATCH carries a list of (meth, args, kwargs)
+and gets back a list of (ok, result), so several calls cost a single
+round trip.
+"""
+
+import itertools
+import logging
+import threading
+import time
+
+BATCH = '__batch__'
+
+class RPCError(Exception):
+    """the remote method raised an exception"""
+
+class RPCTimeout(RPCError):
+    """no reply arrived in time (and there was no stale value to use)"""
+
+class _Pending(object):
+    def __init__(self, meth, cache_key):
+        self.meth = meth
+        self.cache_key = cache_key
+        self.rid = None
+        self.sent = None
+        self.event = threading.Event()
+        self.ok = None
+        self.result = None
+
+class PipeWrapCaller(object):
+    """client side: call methods on the far end of a connection
+
+        pwc = PipeWrapCaller(conn)
+        pwc.index()                 # same as pwc.call('index')
+        pwc.batch(('index',), ('settings',))
+
+    Calls time out after timeout seconds.  The last good result of each
+    argument-less call is kept, and returned (with a warning) if the
+    same call later times out, so a slow or stuck core degrades to
+    stale data instead of hanging every web request.
+
+    If observe is set, it is called with the method and the round trip
+    time (seconds) of every call that gets a reply.
+    """
+
+    def __init__(self, conn, timeout=5.0):
+        logging.debug('initiating PipeWrapCaller')
+        self.conn = conn
+        self.timeout = timeout
+        self.send_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.stale = {}
+        self.observe = None
+        self._ids = itertools.count(1)
+        self._reader = threading.Thread(target=self._read_loop,
+                                        name='rpc-reader', daemon=True)
+        self._reader.start()
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'): raise AttributeError(attr)
+        def _lambda(*args, **kwargs):
+            return self.call(attr, args, kwargs)
+        return _lambda
+
+    def call(self, meth, args=(), kwargs=None, timeout=None):
+        if kwargs is None: kwargs = {}
+        cache_key = None if (args or kwargs) else meth
+        p = self._send(meth, args, kwargs, cache_key)
+        try:
+            return self._wait(p, timeout)
+        except RPCTimeout:
+            if cache_key in self.stale:
+                logging.warning('PipeWrapCaller %s timed out, '
+                                'returning stale value', meth)
+                return self.stale[cache_key]
+            raise
+
+    def batch(self, *calls, timeout=None):
+        """make several calls in one round trip
+
+        Each call is (meth,), (meth, args) or (meth, args, kwargs).
+        Returns the list of results; raises RPCError if any failed.
+        """
+        reqs = []
+        for c in calls:
+            args = tuple(c[1]) if len(c) > 1 else ()
+            kwargs = dict(c[2]) if len(c) > 2 else {}
+            reqs.append( (c[0], args, kwargs) )
+        p = self._send(BATCH, (reqs,), {}, None)
+        results = []
+        for (meth, args, kwargs), (ok, result) in \
+                zip(reqs, self._wait(p, timeout)):
+            if not ok: raise RPCError('%s: %s' % (meth, result))
+            results.append(result)
+        return results
+
+    def _send(self, meth, args, kwargs, cache_key):
+        logging.debug('PipeWrapCaller (%s, %s, %s)', meth, args, kwargs)
+        p = _Pending(meth, cache_key)
+        with self.lock:
+            p.rid = next(self._ids)
+            self.pending[p.rid] = p
+        try:
+            with self.send_lock:
+                p.sent = time.perf_counter()
+                self.conn.send( (p.rid, meth, args, kwargs) )
+        except Exception:
+            with self.lock:
+                self.pending.pop(p.rid, None)
+            raise
+        return p
+
+    def _wait(self, p, timeout):
+        if timeout is None: timeout = self.timeout
+        if not p.event.wait(timeout):
+            with self.lock:
+                self.pending.pop(p.rid, None)
+            raise RPCTimeout('%s: no reply in %.1f seconds'
+                             % (p.meth, timeout))
+        if self.observe is not None:
+            self.observe(p.meth, time.perf_counter() - p.sent)
+        if not p.ok:
+            raise RPCError('%s: %s' % (p.meth, p.result))
+        logging.debug('PipeWrapCaller %s --> %10.10s...', p.meth, p.result)
+        return p.result
+
+    def _read_loop(self):
         while True:
-            self.cp.poll(None)
-            
-            with self.clock:
-                print('child reading from pipe ...')
-                args, kwargs = self.cp.recv()
-                print('child calling target process')
-            resp = self.func(*args, **kwargs)
-            print('child sending response back over pipe')
-            self.cp.send(resp)
-        
-        
-        
-
-class PWrap(object):
-    def __init__(self, conn):
+            try:
+                rid, ok, result = self.conn.recv()
+            except (EOFError, OSError):
+                logging.error('PipeWrapCaller connection closed')
+                with self.lock:
+                    pending, self.pending = self.pending, {}
+                for p in pending.values():
+                    p.ok, p.result = False, 'connection closed'
+                    p.event.set()
+                return
+            with self.lock:
+                p = self.pending.pop(rid, None)
+            if p is None:
+                logging.warning('PipeWrapCaller dropping late reply %d', rid)
+                continue
+            if ok and p.cache_key is not None:
+                self.stale[p.cache_key] = result
+            p.ok, p.result = ok, result
+            p.event.set()
+
+class PipeWrapServer(object):
+    """server side: answer requests from a PipeWrapCaller by calling
+    obj.<prefix><meth>(*args, **kwargs)
+
+    handle() reads and answers one request; call it whenever the
+    connection is readable.  It raises EOFError if the other end has
+    gone away.  requests and errors count the calls made (each call in
+    a batch counts) and the ones that raised.
+    """
+
+    def __init__(self, conn, obj, prefix=''):
         self.conn = conn
+        self.obj = obj
+        self.prefix = prefix
+        self.requests = 0
+        self.errors = 0
 
-    def __call__(self, *args, **kwargs):
-        self.conn.send(args, kwargs)
-        resp = self.conn.recv()
-        return resp
-    
+    def _call(self, meth, args, kwargs):
+        logging.debug('handling request: (%s, %s, %s)', meth, args, kwargs)
+        self.requests += 1
+        try:
+            result = getattr(self.obj, self.prefix + meth)(*args, **kwargs)
+        except Exception as e:
+            self.errors += 1
+            logging.exception('exception raised in request: (%s, %s, %s)',
+                              meth, args, kwargs)
+            return False, repr(e)
+        logging.debug('request: (%s, %s, %s) -> %20.20s',
+                      meth, args, kwargs, result)
+        return True, result
 
-    
+    def handle(self):
+        rid, meth, args, kwargs = self.conn.recv()
+        if meth == BATCH:
+            reply = (rid, True, [ self._call(*req) for req in args[0] ])
+        else:
+            reply = (rid,) + self._call(meth, args, kwargs)
+        self.conn.send(reply)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""plot the data logs over a range of days
+
+    python3 -m dust_filter.plotdust --start 2020-01-01 --end 2020-06-30 \\
+        --ave 300,3600 -o dust.png
+
+The readings are loaded through History as arrays and replayed through
+DFControl.update_batch (or, with --logged, drawn with the levels that
+were logged).  Moving averages are computed from cumulative sums, and
+the lines are cut down to about --max-points points (see decimate;
+the raw readings keep each stretch's min and max, so peaks survive)
+before they are drawn.
+"""
+
+import argparse
+import datetime
+import logging
+import sys
+import time
+
+import matplotlib
+import matplotlib.collections
+import matplotlib.dates
+import matplotlib.pyplot as plt
+import numpy as np
+
+from . import decimate
+from .control import DFControl
+from .history import History, DATEFMT
+from .defaults import DEFAULT_CONFIG, CONFIG_PATH
+from .mdsutils import config
+from .plots import level_spans
+
+SPAN_COLORS = ((1, 'green'), (2, 'yellow'), (3, 'red'))
+AVE_COLORS = ('m', 'g', 'c', 'b')
+
+def moving_ave(t, r, win):
+    """trailing mean of r over the win seconds up to each sample"""
+    c = np.concatenate(([0.0], np.cumsum(r)))
+    i = np.arange(1, len(t) + 1)
+    j = np.searchsorted(t, t - win, 'right')
+    return (c[i] - c[j]) / (i - j)
+
+def _mdates(t):
+    """unix times -> matplotlib dates in local time"""
+    hours, inv = np.unique(np.floor(t / 3600), return_inverse=True)
+    offs = np.array([ time.localtime(h * 3600).tm_gmtoff for h in hours ])
+    epoch = matplotlib.dates.date2num(np.datetime64('1970-01-01'))
+    return (t + offs[inv]) / 86400.0 + epoch
+
+def plot(t, r, sv, level, thresholds, aves=(), max_points=None):
+    """draw the raw readings, smoothed value, moving averages, level
+    spans and thresholds, each line cut down to max_points (default:
+    the axes' width in pixels); returns the figure"""
+    x = _mdates(t)
+    top = 1.2 * max(float(sv.max()), thresholds[-1])
+    fig, ax = plt.subplots(figsize=(16, 6))
+    if max_points is None:
+        max_points = int(ax.get_position().width * fig.bbox.width)
+    for v, color in SPAN_COLORS:
+        x0, x1 = level_spans(x, level, v)
+        verts = np.zeros((len(x0), 4, 2))
+        verts[:, 0, 0] = verts[:, 1, 0] = x0
+        verts[:, 2, 0] = verts[:, 3, 0] = x1
+        verts[:, 1, 1] = verts[:, 2, 1] = top
+        ax.add_collection(matplotlib.collections.PolyCollection(
+            verts, facecolors=color, alpha=0.5, linewidths=0))
+    ax.plot(*decimate.minmax(x, r, max_points), 'k', linewidth=0.5,
+            label='raw')
+    ax.plot(*decimate.lttb(x, sv, max_points), 'r', linewidth=0.5,
+            label='smoothed')
+    for win, color in zip(aves, AVE_COLORS):
+        ax.plot(*decimate.lttb(x, moving_ave(t, r, win), max_points), color,
+                linewidth=0.6, label='%g s mean' % win)
+    for th in thresholds:
+        ax.axhline(th, color='b', linewidth=0.8)
+    ax.set_xlim(x[0], x[-1])
+    ax.set_ylim(0, top)
+    ax.xaxis_date()
+    ax.set(xlabel='time', ylabel='LO ratio', title='low occupancy time')
+    ax.legend(loc='upper right')
+    ax.grid()
+    fig.autofmt_xdate()
+    return fig
+
+def _floats(s):
+    return [ float(x) for x in s.split(',') ]
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='plot the data logs')
+    a = p.add_argument
+    a('-C', '--conf', help='append FILE to the config file path')
+    a('--data-prefix', help='data log prefix (default: from config)')
+    a('--start', help='first day to plot (YYYY-MM-DD)')
+    a('--end', help='last day to plot (YYYY-MM-DD, default: today)')
+    a('--days', type=int, default=1,
+      help='number of days to plot if --start is not given')
+    a('-t', '--thresholds', type=_floats,
+      help='comma-separated thresholds to replay with (default: from '
+      'config)')
+    a('--smooth-win', type=float, default=60.0,
+      help='DFControl smoothing window (seconds)')
+    a('--min-run', type=float, default=300.0,
+      help='DFControl minimum run time (seconds)')
+    a('--logged', action='store_true',
+      help="draw the logged levels instead of replaying")
+    a('--ave', type=_floats, default=[],
+      help='comma-separated moving-average windows to add (seconds)')
+    a('--max-points', type=int,
+      help='decimate each line to about this many points (default: '
+      'the width of the plot in pixels)')
+    a('-o', '--output', default='dust.png', help='image file to write')
+    a('--show', action='store_true', help='also show the plot')
+    args = p.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.conf: CONFIG_PATH.append(args.conf)
+    c_default = config.load_config(DEFAULT_CONFIG, source='<default>')
+    conf = config.merge_configs([c_default] +
+                                config.load_config_files(CONFIG_PATH))
+    prefix = args.data_prefix or conf.data_prefix
+    thresholds = args.thresholds or conf.thresholds
+
+    if args.end: end = datetime.datetime.strptime(args.end, DATEFMT).date()
+    else:        end = datetime.date.today()
+    if args.start:
+        start = datetime.datetime.strptime(args.start, DATEFMT).date()
+    else:
+        start = end - datetime.timedelta(days=args.days - 1)
+
+    t0 = time.time()
+    h = History(prefix)
+    t, r, level = h.range(time.mktime(start.timetuple()),
+        time.mktime((end + datetime.timedelta(days=1)).timetuple()))
+    if len(t) < 2:
+        logging.error('no data found for %s%s .. %s', prefix, start, end)
+        return 1
+    logging.info('loaded %d samples in %.1f seconds', len(t),
+                 time.time() - t0)
+
+    if not args.show: plt.switch_backend('Agg')
+    dfc = DFControl(thresholds, args.smooth_win, args.min_run)
+    sv, replayed = dfc.update_batch(t, r)
+    if not args.logged: level = replayed
+    fig = plot(t, r, sv, level, thresholds, args.ave, args.max_points)
+    fig.savefig(args.output)
+    logging.info('wrote %s in %.1f seconds', args.output, time.time() - t0)
+    if args.show: plt.show()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
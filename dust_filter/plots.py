@@ -4,12 +4,17 @@ from datetime import datetime
 import math
 import io
 import logging
+import collections
+import time
 
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import numpy as np
 
+from . import decimate
+from .metrics import Metrics
+
 
 def moving_ave(t, r, N):
     tf = [ t[i]            for i in range(N, len(t)) ]
@@ -53,7 +58,7 @@ def mobile_plot(t, level, rr, ra, thresh):
     """
 
     logging.debug('entering mobile_plot')
-    fig, ax = plt.subplots(1)
+    fig, ax = plt.subplots(1, dpi=200)
     logging.debug('setting up figure')
     fig.set_size_inches(4, 2.5)
     fig.patch.set_facecolor((0,0,0))
@@ -76,8 +81,14 @@ def mobile_plot(t, level, rr, ra, thresh):
     rap = [ r*100.0 for r in ra ]
     thp = [ th*100.0 for th in thresh ]
     logging.debug('plotting')
-    ax.plot(dtt(t), rrp, 'r', marker='.', linewidth=0.5)
-    ax.plot(dtt(t), rap, 'w', marker='.', linewidth=0.5)
+    # no more points than the axes are pixels wide
+    n = int(fig.get_figwidth() * fig.dpi * ax.get_position().width)
+    ir = decimate.minmax_indices(rrp, n).tolist()
+    ia = decimate.lttb_indices(t, rap, n).tolist()
+    ax.plot(dtt([ t[i] for i in ir ]), [ rrp[i] for i in ir ],
+            'r', marker='.', linewidth=0.5)
+    ax.plot(dtt([ t[i] for i in ia ]), [ rap[i] for i in ia ],
+            'w', marker='.', linewidth=0.5)
     TOP = 1.2 * max( (max(rrp), thp[-1]) )
     ax.fill_between(dtt(t), 0, TOP, where=level_mask(level, 1),
                     facecolor='green', alpha=0.3)
@@ -94,7 +105,7 @@ def mobile_plot(t, level, rr, ra, thresh):
     ax.axes.xaxis.set_ticklabels([])
     fo = io.BytesIO()
     logging.debug('saving fig')
-    fig.savefig(format='png', fname=fo, transparent=True, dpi=200)
+    fig.savefig(format='png', fname=fo, transparent=True, dpi=fig.dpi)
     plt.close()
     fo.seek(0)
     data = fo.read()
@@ -102,40 +113,192 @@ def mobile_plot(t, level, rr, ra, thresh):
     logging.debug('leaving mobile_plot')
     return data
 
+def level_spans(x, level, v):
+    """return (start, stop) x pairs covering the runs where level == v
+
+    Like level_mask, each run is extended to the following sample.
+    """
+    on = np.concatenate(([False], np.asarray(level) == v, [False]))
+    edges = np.flatnonzero(np.diff(on.astype(np.int8)))
+    starts, stops = edges[0::2], edges[1::2]
+    stops = np.minimum(stops, len(x) - 1)
+    return x[starts], x[stops]
+
+# x tick marks for each plot window (see rollup.WINDOWS)
+WINDOW_TICKS = {
+    '5m':  lambda: matplotlib.dates.MinuteLocator(interval=1),
+    '1h':  lambda: matplotlib.dates.MinuteLocator(byminute=range(0, 60, 10)),
+    '24h': lambda: matplotlib.dates.HourLocator(byhour=range(0, 24, 3)),
+    '7d':  lambda: matplotlib.dates.DayLocator(),
+    }
+
+class MobilePlot(object):
+    """persistent renderer producing the same plot as mobile_plot
+
+    The figure, axes, styling and artists are built once and only their
+    data is updated for each frame.  Everything that depends only on
+    the y range (the axes background and the y axis) is rendered once
+    and cached; each frame restores that background and draws the
+    level spans, lines, thresholds, spines and time axis onto it.
+    """
+
+    SPAN_COLORS = ((1, 'green'), (2, 'yellow'), (3, 'red'))
+
+    def __init__(self, dpi=200, locator=None):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.collections import PolyCollection
+
+        self.fig = fig = Figure(figsize=(4, 2.5), dpi=dpi)
+        self.canvas = FigureCanvasAgg(fig)
+        self.ax = ax = fig.add_subplot(1, 1, 1)
+        # savefig(transparent=True) clears both patches, so do it here
+        fig.patch.set_alpha(0)
+        ax.patch.set_alpha(0)
+        for s in ax.spines.values():
+            s.set_color('white')
+        ax.tick_params(axis='x', colors='white')
+        ax.tick_params(axis='y', colors='white')
+        fig.subplots_adjust(left=0.1, bottom=0.15,
+                            right=0.99, top=0.99, wspace=0, hspace=0)
+        if locator is None:
+            locator = matplotlib.dates.MinuteLocator(interval=1)
+        ax.xaxis.set_major_locator(locator)
+        ax.xaxis.set_major_formatter(matplotlib.ticker.NullFormatter())
+        ax.xaxis_date()
+
+        self.spans = []
+        for v, color in self.SPAN_COLORS:
+            pc = PolyCollection([], facecolor=color, alpha=0.3)
+            ax.add_collection(pc)
+            self.spans.append((v, pc))
+        self.raw_line, = ax.plot([], [], 'r', marker='.', linewidth=0.5)
+        self.ave_line, = ax.plot([], [], 'w', marker='.', linewidth=0.5)
+        self.thresh_lines = []
+
+        self._dynamic = [ pc for v, pc in self.spans ] + \
+            [self.raw_line, self.ave_line]
+        for a in self._dynamic + [ax.xaxis] + list(ax.spines.values()):
+            a.set_animated(True)
+        self._bg = None
+        self._bg_top = None
+        # lines are decimated to no more points than this (the axes'
+        # width in pixels)
+        self.max_points = int(ax.get_position().width * fig.bbox.width)
+
+    def _set_thresholds(self, thp):
+        while len(self.thresh_lines) < len(thp):
+            l = self.ax.axhline(0, color='b', linewidth=0.6, animated=True)
+            self.thresh_lines.append(l)
+        for l, th in zip(self.thresh_lines, thp):
+            l.set_ydata([th, th])
+            l.set_visible(True)
+        for l in self.thresh_lines[len(thp):]:
+            l.set_visible(False)
+
+    def render(self, t, level, rr, ra, thresh):
+        """render one frame; arguments are as for mobile_plot
+
+        return plot data (bytes object containing a png)
+        """
+        t = np.asarray(t, dtype=float)
+        rrp = np.asarray(rr, dtype=float) * 100.0
+        rap = np.asarray(ra, dtype=float) * 100.0
+        thp = [ th*100.0 for th in thresh ]
+
+        # matplotlib dates, in local time like dtt()
+        x = matplotlib.dates.date2num(dtt(t[0])) + (t - t[0]) / 86400.0
+        TOP = 1.2 * max( (rrp.max(), thp[-1]) )
+
+        ax = self.ax
+        self.raw_line.set_data(*decimate.minmax(x, rrp, self.max_points))
+        self.ave_line.set_data(*decimate.lttb(x, rap, self.max_points))
+        for v, pc in self.spans:
+            x0, x1 = level_spans(x, level, v)
+            pc.set_verts([ ((a, 0), (a, TOP), (b, TOP), (b, 0))
+                           for a, b in zip(x0.tolist(), x1.tolist()) ])
+        self._set_thresholds(thp)
+        ax.set_xlim(x[0], x[-1])
+
+        if self._bg is None or not TOP == self._bg_top:
+            ax.set_ylim(0, TOP)
+            self.canvas.draw()
+            self._bg = self.canvas.copy_from_bbox(self.fig.bbox)
+            self._bg_top = TOP
+        else:
+            self.canvas.restore_region(self._bg)
+        for a in self._dynamic + self.thresh_lines + \
+                list(ax.spines.values()) + [ax.xaxis]:
+            if a.get_visible(): ax.draw_artist(a)
+
+        fo = io.BytesIO()
+        buf = np.asarray(self.canvas.buffer_rgba())
+        matplotlib.image.imsave(fo, buf, format='png', dpi=self.fig.dpi)
+        return fo.getvalue()
+
 def _test_data():
     start = 1589722625
     stop = start + 5*60
-    rr = []
-    ra = []
-    t = []
-    level = []
-    
+
     from .control import DFControl
     thresh = [0.01, 0.02, 0.04, 0.08]
     dfc = DFControl(thresh)
     import pathlib
     p = pathlib.Path(__file__).parent.joinpath('dustlog.csv')
-    with p.open() as csvfile:
-        plots = csv.reader(csvfile, delimiter=',')
-        for row in plots:
-            ti = float(row[0])
-            ri = float(row[1])
-            li = int(row[2])
-            dfc.update(ri, ti)
-
-            if ti < start or ti > stop: continue
-
-            t.append(ti)
-            rr.append(ri)
-            ra.append(dfc._sv)
-            level.append(li)
+    data = np.loadtxt(str(p), delimiter=',', ndmin=2)
+    ta, rra, la = data[:, 0], data[:, 1], data[:, 2]
+    raa, _ = dfc.update_batch(ta, rra)
+
+    w = (ta >= start) & (ta <= stop)
+    t = ta[w].tolist()
+    rr = rra[w].tolist()
+    ra = raa[w].tolist()
+    level = la[w].astype(int).tolist()
     return t, level, rr, ra, thresh
     
+class PlotFeed(object):
+    """the receiving end of the core's plot messages
+
+    Each message carries the window, the new points (the whole series
+    for the longer windows), new thresholds (or None) and the start of
+    the window.  The feed keeps a mirror of the core's 5-minute plot
+    history and the current thresholds, and renders a window on
+    request.
+    """
+
+    def __init__(self):
+        self.history = collections.deque()
+        self.thresh = None
+        self.plotters = {}
+
+    def update(self, msg):
+        """apply a message; return (window, points to plot)"""
+        window, points, new_thresh, start = msg
+        if new_thresh is not None: self.thresh = new_thresh
+        if window == '5m':
+            history = self.history
+            history.extend(points)
+            while history and history[0][0] < start:
+                history.popleft()
+            points = history
+        return window, points
+
+    def render(self, window, points):
+        if window not in self.plotters:
+            self.plotters[window] = \
+                MobilePlot(locator=WINDOW_TICKS[window]())
+        t, l, rr, ra = tuple(zip(*points))
+        return self.plotters[window].render(t, l, rr, ra, self.thresh)
+
 def plotproc(logq, pipe):
     h = logging.handlers.QueueHandler(logq)
     root = logging.getLogger()
     root.addHandler(h)
     root.setLevel(logging.DEBUG)
+    feed = PlotFeed()
+    # sent back with every plot, for the core's /metrics
+    metrics = Metrics()
+    messages = metrics.counter('df_plot_messages_total')
     while True:
         logging.debug('plot proc reading from pipe ...')
         d = pipe.recv()
@@ -143,15 +306,48 @@ def plotproc(logq, pipe):
         if d is None:
             logging.debug('plot proc exiting')
             break
-        logging.debug('plot proc generating plot')
-        data = mobile_plot(*d)
+        messages.inc()
+        window, points = feed.update(d)
+        logging.debug('plot proc generating %s plot', window)
+        t0 = time.perf_counter()
+        data = feed.render(window, points)
+        metrics.histogram('df_plot_render_seconds', window=window).observe(
+            time.perf_counter() - t0)
         logging.debug('plot proc sending plot data back')
-        pipe.send(data)
+        pipe.send( (window, data, metrics.snapshot()) )
+
+def _bench(frames=50):
+    """compare ms/frame of mobile_plot and MobilePlot over a sliding window"""
+    import time
+    from .control import DFControl
+    import pathlib
+    p = pathlib.Path(__file__).parent.joinpath('dustlog.csv')
+    data = np.loadtxt(str(p), delimiter=',', ndmin=2)
+    thresh = [0.01, 0.02, 0.04, 0.08]
+    ta, rra = data[:, 0], data[:, 1]
+    raa, la = DFControl(thresh).update_batch(ta, rra)
+    first = np.searchsorted(ta, 1589722625)
+    windows = [ (ta[i:i+60].tolist(), la[i:i+60].tolist(),
+                 rra[i:i+60].tolist(), raa[i:i+60].tolist(), thresh)
+                for i in range(first, first + frames) ]
+
+    mp = MobilePlot()
+    for name, func in (('mobile_plot', mobile_plot),
+                       ('MobilePlot', mp.render)):
+        start = time.perf_counter()
+        for w in windows:
+            func(*w)
+        dt = time.perf_counter() - start
+        print('%-12s %7.1f ms/frame' % (name, 1000 * dt / frames))
 
 if __name__ == '__main__':
+    import sys
+    if sys.argv[1:] == ['bench']:
+        _bench()
+        sys.exit()
     root = logging.getLogger()
     root.setLevel(logging.DEBUG)
     t, level, rr, ra, thresh = _test_data()
-    data = mobile_plot(t, level, rr, ra, thresh)
+    data = MobilePlot().render(t, level, rr, ra, thresh)
     with open('output.png', 'bw') as fo:
         fo.write(data)
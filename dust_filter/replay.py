@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""run the control loop headless on a virtual clock
+
+    python3 -m dust_filter.replay --start 2020-05-17 --days 30 -o replay
+
+The real DustFilter code - read_sensor, DFControl, Motor, the data logs,
+the rollups and the plot feed - runs in a single process with mock
+hardware, but instead of waiting in select() between readings the clock
+simply jumps to the next poll time.  A simulated month takes seconds
+of CPU rather than a month (or a month / mock_speed) of wall time.
+
+Everything written to the output directory - data logs (CSV and
+binary), archives, rollups and plots - is derived from the readings
+and the virtual clock, never the wall clock, so a replay of the same
+data with the same config writes the same files, byte for byte.  The
+digest printed at the end is a hash of all of them, to compare runs
+(e.g. before and after a change).  The files' modification times are
+not part of it.
+
+The config is read as for the core (the config files, then -C FILE),
+with the replay's own options on top.  The plot process is replaced by
+a PlotFeed fed directly; with --plot-every, it renders the 5-minute
+plot that often (in simulated time) into <output>/plots.
+"""
+
+import argparse
+import datetime
+import hashlib
+import logging
+import math
+import os
+import sys
+import time
+
+from . import plots
+from .core import DustFilter, DEFAULT_CONFIG, CONFIG_PATH
+from .mdsutils import config
+
+class VirtualClock(object):
+    """a clock that only moves when it is told to; call it for the time"""
+
+    def __init__(self, t=0.0):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+class ReplayPlotConn(object):
+    """stands in for the core's end of the plot pipe: messages go
+    straight into a PlotFeed, and every render_every seconds (of the
+    clock) the 5-minute plot is rendered into plot_dir"""
+
+    def __init__(self, clock, render_every=0, plot_dir=None):
+        self.clock = clock
+        self.feed = plots.PlotFeed()
+        self.render_every = render_every
+        self.plot_dir = plot_dir
+        self.messages = 0
+        self.points = 0
+        self.renders = 0
+        self._next_render = None
+
+    def send(self, msg):
+        self.messages += 1
+        self.points += len(msg[1])
+        window, points = self.feed.update(msg)
+        if not self.render_every or not window == '5m': return
+        now = self.clock()
+        if self._next_render is None:
+            self._next_render = now - now % self.render_every
+        if now < self._next_render: return
+        data = self.feed.render(window, points)
+        fn = time.strftime('5m_%Y-%m-%d_%H%M%S.png', time.localtime(now))
+        with open(os.path.join(self.plot_dir, fn), 'wb') as f:
+            f.write(data)
+        self.renders += 1
+        self._next_render += self.render_every * \
+            (1 + (now - self._next_render) // self.render_every)
+
+    def poll(self, timeout=0):
+        return False # nothing ever comes back
+
+class ReplayFilter(DustFilter):
+    """a DustFilter with mock hardware, driven by a VirtualClock
+
+    settings override the config files (and are how the replay points
+    the logs at its output directory).
+    """
+
+    def __init__(self, clock, plot_conn, settings, conf_file=None):
+        self.clock = clock
+        self._settings = dict(settings, mock=True)
+        self._conf_file = conf_file
+        DustFilter.__init__(self, plot_conn, None)
+        self.clock.t = float(self.conf.mock_start)
+        self.logwriter.block = True # a replay can't drop readings
+        self.readings = 0
+        self.level_time = [0.0] * (len(self.conf.motor_gpios) + 1)
+
+    def config(self):
+        path = CONFIG_PATH + ([self._conf_file] if self._conf_file else [])
+        c_default = config.load_config(DEFAULT_CONFIG, source='<default>')
+        c_replay = config.convert_command_line_args(self._settings)
+        configs = [c_default] + config.load_config_files(path) + [c_replay]
+        self.conf = config.merge_configs(configs)
+        self.conf._configs = configs
+
+    def _mock_time(self):
+        return self.clock()
+
+    def run(self, end):
+        """take a reading every poll seconds, as loop() does, until
+        the clock reaches end"""
+        poll = self.conf.poll
+        next_read_time = math.ceil(self.clock())
+        while next_read_time < end:
+            self.clock.t = next_read_time
+            self.read_sensor()
+            active = self.motor.get()
+            self.readings += 1
+            self.level_time[active] += poll
+            next_read_time = next_read_time + poll
+
+    def finish(self):
+        """close the rollups and logs, and archive the closed days
+        (the background archiver may have skipped some)"""
+        self.rollup.close()
+        self.logwriter.close()
+        self.archiver.join()
+        if self.archiver.method or self.archiver.keep_days:
+            self.archiver.run(datetime.date.fromtimestamp(self.clock()))
+
+def digest(path):
+    """sha256 of the names and contents of every file under path, and
+    a {name: sha256} dict of the files"""
+    total = hashlib.sha256()
+    files = {}
+    for d, dirs, names in sorted(os.walk(path)):
+        dirs.sort()
+        for name in sorted(names):
+            fn = os.path.join(d, name)
+            with open(fn, 'rb') as f:
+                h = hashlib.sha256(f.read()).hexdigest()
+            rel = os.path.relpath(fn, path)
+            files[rel] = h
+            total.update(('%s %s\n' % (rel, h)).encode())
+    return total.hexdigest(), files
+
+def _time_arg(s):
+    """a unix time, or a local date YYYY-MM-DD"""
+    try:
+        return float(s)
+    except ValueError:
+        d = datetime.datetime.strptime(s, '%Y-%m-%d')
+        return time.mktime(d.timetuple())
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='replay the control loop '
+                                'headless on a virtual clock')
+    a = p.add_argument
+    a('-C', '--conf', help='append FILE to the config file path')
+    a('-o', '--output', default='replay',
+      help='directory for the logs, rollups and plots (must be empty)')
+    a('--start', type=_time_arg,
+      help='unix time or date to start at (default: mock_start)')
+    a('--days', type=float, default=1.0, help='days to simulate')
+    a('--data', nargs='+',
+      help='data logs to replay (default: mock_data from the config)')
+    a('--no-loop', action='store_true',
+      help="don't repeat the data when it runs out")
+    a('--plot-every', type=float, default=0,
+      help='render the 5-minute plot every this many simulated seconds')
+    a('--digests', action='store_true',
+      help='list the sha256 of every output file')
+    a('-v', '--verbose', action='store_true', help='log at INFO level')
+    args = p.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else
+                        logging.ERROR, format='%(levelname)s %(message)s')
+    if os.path.isdir(args.output) and os.listdir(args.output):
+        p.error('output directory %s is not empty' % args.output)
+    plot_dir = os.path.join(args.output, 'plots')
+    os.makedirs(plot_dir if args.plot_every else args.output, exist_ok=True)
+
+    settings = {'data_prefix': os.path.join(args.output, 'dust_'),
+                'rollup_prefix': os.path.join(args.output, 'rollup_'),
+                'lazy_plots': False}
+    if args.start is not None: settings['mock_start'] = args.start
+    if args.data: settings['mock_data'] = args.data
+    if args.no_loop: settings['mock_loop'] = False
+
+    clock = VirtualClock()
+    conn = ReplayPlotConn(clock, args.plot_every, plot_dir)
+    df = ReplayFilter(clock, conn, settings, args.conf)
+    start = clock()
+    t0 = time.perf_counter()
+    df.run(start + args.days * 86400)
+    df.finish()
+    elapsed = time.perf_counter() - t0
+
+    total = sum(df.level_time) or 1.0
+    print('%d readings (%.2f days) in %.1f s, %.0f readings/s'
+          % (df.readings, (clock() - start) / 86400, elapsed,
+             df.readings / elapsed))
+    print('motor: %d transitions; time at level %s' % (df.motor.transitions,
+          ' '.join('%d:%.1f%%' % (i, 100 * s / total)
+                   for i, s in enumerate(df.level_time))))
+    print('plot feed: %d messages, %d points, %d renders'
+          % (conn.messages, conn.points, conn.renders))
+    stats = df.logwriter.stats()
+    print('data log: %d written, %d dropped, %d commits'
+          % (stats['written'], stats['dropped'], stats['commits']))
+    h, files = digest(args.output)
+    if args.digests:
+        for name, fh in sorted(files.items()):
+            print('  %s  %s' % (fh, name))
+    print('digest %s' % h)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
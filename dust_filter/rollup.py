@@ -0,0 +1,252 @@
+"""incremental time-bucket rollups of the sensor readings
+
+Each Tier groups readings into fixed-width time buckets (a minute, an
+hour, a day) and keeps a bounded number of them, so long-range plots,
+reports and APIs can work from a few hundred pre-aggregated rows
+instead of every raw sample.  A bucket holds the count, min, max and
+mean of the raw readings, the mean of the smoothed average, the
+highest control level, and the seconds the motor spent at each level.
+Day buckets run from local midnight to local midnight, like the daily
+data logs; the others are aligned to the epoch.
+
+Completed buckets are appended to a small binary file per tier
+(<prefix><tier>.dat, one RECORD each), which is read back at startup
+and rewritten with only the retained buckets once it grows to twice
+the retention.
+"""
+
+import collections
+import logging
+import os
+import struct
+
+import numpy as np
+
+from .datalog import day_bounds
+
+DAY = 86400
+NLEVELS = 4 # Off, Low, Med, High
+
+# start, count, raw min, raw max, raw mean, average mean, max level,
+# seconds at each motor level
+RECORD = struct.Struct('<dI4fB3x%df' % NLEVELS)
+RECORD_DTYPE = np.dtype({
+    'names':   ['start', 'count', 'raw_min', 'raw_max', 'raw_mean',
+                'ave_mean', 'level', 'seconds'],
+    'formats': ['<f8', '<u4', '<f4', '<f4', '<f4', '<f4', 'u1',
+                ('<f4', NLEVELS)],
+    'offsets': [0, 8, 12, 16, 20, 24, 28, 32],
+    'itemsize': RECORD.size})
+
+Bucket = collections.namedtuple(
+    'Bucket', 'start count raw_min raw_max raw_mean ave_mean level seconds')
+
+def bucket_bounds(t, width):
+    """the start and end of the width-second bucket holding t (a
+    local day for a day-wide bucket)"""
+    if width == DAY: return day_bounds(t)
+    start = t - t % width
+    return start, start + width
+
+class Tier(object):
+    """fixed-width time buckets over the readings
+
+    At most retention completed buckets are kept, plus the one being
+    filled.  If path is given, completed buckets are persisted there.
+    """
+
+    def __init__(self, name, width, retention, path=None):
+        self.name = name
+        self.width = width
+        self.retention = retention
+        self.path = path
+        self.buckets = collections.deque(maxlen=retention)
+        # [start, count, raw min, raw max, raw sum, ave sum, level,
+        #  seconds list]
+        self._cur = None
+        self._end = None # end of the bucket being filled
+        self._file = None
+        self._nfile = 0 # records in the file
+        if path is not None:
+            self._load()
+
+    def add(self, t, level, raw, ave, motor=None, dt=0):
+        """add a reading; dt seconds are credited to motor level motor
+        (the level the motor ran at since the previous reading)"""
+        cur = self._cur
+        if cur is None or not cur[0] <= t < self._end:
+            if cur is not None: self._complete()
+            start, self._end = bucket_bounds(t, self.width)
+            cur = self._cur = self._resume(start)
+        if cur is None:
+            cur = self._cur = [start, 1, raw, raw, raw, ave, level,
+                               [0.0] * NLEVELS]
+        else:
+            cur[1] += 1
+            cur[2] = min(cur[2], raw)
+            cur[3] = max(cur[3], raw)
+            cur[4] += raw
+            cur[5] += ave
+            cur[6] = max(cur[6], level)
+        if motor is not None and dt > 0:
+            cur[7][motor] += dt
+
+    def _bucket(self, b):
+        start, n, rmin, rmax, rsum, asum, level, seconds = b
+        return Bucket(start, n, rmin, rmax, rsum / n, asum / n, level,
+                      tuple(seconds))
+
+    def _resume(self, start):
+        """pick up a bucket that was persisted part-filled at exit"""
+        if not (self.buckets and self.buckets[-1].start == start):
+            return None
+        b = self.buckets.pop()
+        return [b.start, b.count, b.raw_min, b.raw_max,
+                b.raw_mean * b.count, b.ave_mean * b.count, b.level,
+                list(b.seconds)]
+
+    def _complete(self):
+        b = self._bucket(self._cur)
+        self._cur = None
+        self.buckets.append(b)
+        self._save(b)
+
+    def current(self):
+        """the bucket being filled, or None"""
+        return None if self._cur is None else self._bucket(self._cur)
+
+    def rows(self, since=None):
+        """return the Buckets starting after since, oldest first,
+        including the one being filled"""
+        rows = list(self.buckets)
+        if self._cur is not None: rows.append(self._bucket(self._cur))
+        if since is not None:
+            rows = [ b for b in rows if b.start > since ]
+        return rows
+
+    def points(self, since=None):
+        """return (t, level, raw, ave) for each bucket starting after
+        since: the highest level and raw reading (so short dust peaks
+        stay visible) and the mean average"""
+        return [ (b.start, b.level, b.raw_max, b.ave_mean)
+                 for b in self.rows(since) ]
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        n = len(data) // RECORD.size
+        for i in range(n):
+            start, count, rmin, rmax, rmean, amean, level, *seconds = \
+                RECORD.unpack_from(data, i * RECORD.size)
+            b = Bucket(start, count, rmin, rmax, rmean, amean, level,
+                       tuple(seconds))
+            # a bucket written part-filled at exit, then completed
+            if self.buckets and self.buckets[-1].start == start:
+                self.buckets.pop()
+            self.buckets.append(b)
+        self._nfile = n
+        logging.info('rollup %s: loaded %d buckets from %s',
+                     self.name, len(self.buckets), self.path)
+
+    def _pack(self, b):
+        return RECORD.pack(b.start, b.count, b.raw_min, b.raw_max,
+                           b.raw_mean, b.ave_mean, b.level, *b.seconds)
+
+    def _save(self, b):
+        if self.path is None: return
+        if self._nfile + 1 >= 2 * self.retention:
+            self._rewrite()
+            return
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        self._file.write(self._pack(b))
+        self._file.flush()
+        self._nfile += 1
+
+    def _rewrite(self):
+        """replace the file with just the retained buckets"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            for b in self.buckets:
+                f.write(self._pack(b))
+        os.replace(tmp, self.path)
+        self._nfile = len(self.buckets)
+
+    def close(self):
+        """persist the part-filled bucket and close the file"""
+        if self.path is not None and self._cur is not None:
+            self._complete()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def read_tier(path, start=None, end=None):
+    """read a tier's file as a RECORD_DTYPE array, optionally just
+    the buckets starting in [start, end).  This can be used from any
+    process; it only sees completed buckets."""
+    try:
+        recs = np.fromfile(path, RECORD_DTYPE)
+    except FileNotFoundError:
+        recs = np.zeros(0, RECORD_DTYPE)
+    if not len(recs): return recs
+    # a bucket written part-filled at exit, then completed: keep the last
+    recs = recs[np.append(recs['start'][1:] != recs['start'][:-1], True)]
+    i = 0 if start is None else np.searchsorted(recs['start'], start)
+    j = len(recs) if end is None else np.searchsorted(recs['start'], end)
+    return recs[i:j]
+
+class Rollup(object):
+    """the set of tiers fed from each reading
+
+    Seconds between readings are credited to the motor level of the
+    earlier reading, unless the gap is longer than MAX_GAP (the
+    controller wasn't running).
+    """
+
+    # name, bucket width (seconds), buckets kept
+    TIERS = (('minute', 60, 7*24*60),
+             ('hour', 3600, 366*24),
+             ('day', DAY, 10*366))
+    MAX_GAP = 300 # seconds
+
+    def __init__(self, prefix=None):
+        self.tiers = collections.OrderedDict()
+        for name, width, retention in self.TIERS:
+            path = None if prefix is None else '%s%s.dat' % (prefix, name)
+            self.tiers[name] = Tier(name, width, retention, path)
+        self._last = None # (t, motor level) of the previous reading
+
+    def add(self, t, level, raw, ave, motor=None):
+        """add a reading; motor is the level the motor is now running
+        at (defaults to the control level)"""
+        if motor is None: motor = level
+        dt, prev = 0, None
+        if self._last is not None:
+            dt = t - self._last[0]
+            prev = self._last[1]
+            if dt > self.MAX_GAP: dt = 0
+        self._last = (t, motor)
+        for tier in self.tiers.values():
+            tier.add(t, level, raw, ave, prev, dt)
+
+    def close(self):
+        for tier in self.tiers.values():
+            tier.close()
+
+    def __getitem__(self, name):
+        return self.tiers[name]
+
+# plot windows: name -> (tier to draw it from, or None for the raw
+# readings, and the span in seconds)
+WINDOWS = collections.OrderedDict([
+    ('5m',  (None,     5*60)),
+    ('1h',  ('minute', 60*60)),
+    ('24h', ('minute', 24*60*60)),
+    ('7d',  ('hour',   7*24*60*60)),
+    ])
@@ -0,0 +1,106 @@
+"""shared-memory snapshot of the controller state
+
+The core writes the state (the same dict _web_index returns, plus the
+plot generation and expiry time) into a small shared memory segment
+after every reading, rendered plot, and mode or settings change.  The
+web process reads it directly, with no round trip through the core.
+
+Writes are guarded by a sequence counter (a seqlock): the writer makes
+the counter odd, writes the record, then makes it even again.  A
+reader retries until it sees the same even counter before and after
+copying the record, so it never returns a half-written state.  There
+is only ever one writer.
+"""
+
+import struct
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+MAX_THRESHOLDS = 8
+
+# seq, selected, active, n thresholds, average, update time,
+# plot generation, plot expiry time, thresholds
+_SEQ = struct.Struct('<Q')
+_RECORD = struct.Struct('<4s4sB7xddQd%dd' % MAX_THRESHOLDS)
+
+class StateSnapshot(object):
+    """a seqlock-protected state record in shared memory
+
+    Create it in the core with StateSnapshot(create=True) and attach
+    to it from other processes with StateSnapshot(name).  Only the
+    creator tracks the segment: an attached process's resource tracker
+    would otherwise warn about it, or unlink it, when that process
+    exits.
+    """
+
+    SIZE = _SEQ.size + _RECORD.size
+    RETRIES = 100
+
+    def __init__(self, name=None, create=False):
+        if create or sys.version_info < (3, 13):
+            self.shm = shared_memory.SharedMemory(name, create, self.SIZE)
+            if not create:
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+        else:
+            self.shm = shared_memory.SharedMemory(name, create, self.SIZE,
+                                                  track=False)
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        if create:
+            self.buf[:self.SIZE] = bytes(self.SIZE)
+        self._seq = _SEQ.unpack_from(self.buf, 0)[0]
+
+    def write(self, state, t=None):
+        """write a state dict (selected, active, average, thresholds and
+        optionally plot_gen and plot_expires)"""
+        if t is None: t = time.time()
+        th = list(state['thresholds'])[:MAX_THRESHOLDS]
+        active = state['active']
+        if active is None: active = ''
+        rec = _RECORD.pack(state['selected'].encode(), active.encode(),
+                           len(th), state['average'], t,
+                           state.get('plot_gen', 0),
+                           state.get('plot_expires', 0.0),
+                           *(th + [0.0] * (MAX_THRESHOLDS - len(th))))
+        self._seq += 1
+        _SEQ.pack_into(self.buf, 0, self._seq)
+        self.buf[_SEQ.size:self.SIZE] = rec
+        self._seq += 1
+        _SEQ.pack_into(self.buf, 0, self._seq)
+
+    def read(self):
+        """return the latest state dict (with 'time' and 'version'
+        added), or None if nothing has been written yet"""
+        for i in range(self.RETRIES):
+            seq = _SEQ.unpack_from(self.buf, 0)[0]
+            if seq == 0: return None
+            if seq % 2:
+                time.sleep(0)
+                continue
+            rec = bytes(self.buf[_SEQ.size:self.SIZE])
+            if _SEQ.unpack_from(self.buf, 0)[0] == seq:
+                break
+        else:
+            return None
+        sel, act, n, ave, t, gen, expires, *th = _RECORD.unpack(rec)
+        return {'selected': sel.rstrip(b'\0').decode(),
+                'active': act.rstrip(b'\0').decode() or None,
+                'average': ave,
+                'thresholds': th[:n],
+                'time': t,
+                'plot_gen': gen,
+                'plot_expires': expires,
+                'version': seq // 2}
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        if sys.version_info < (3, 13):
+            # an attached process sharing our resource tracker (any
+            # multiprocessing child) unregistered the segment for us too;
+            # unlink() unregisters it again
+            resource_tracker.register(self.shm._name, 'shared_memory')
+        self.shm.unlink()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""replay historical data logs through DFControl for a grid of
+thresholds, smooth_win and min_run values
+
+    python3 -m dust_filter.sweep --days 90 --scale 0.75,1,1.5 \\
+        --smooth-win 30,60,90 --min-run 120,300,600
+
+For each candidate, report the time spent at each level, the number of
+level switches and how long the controller takes to react when the raw
+reading crosses the event threshold.
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import datetime
+import itertools
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+from .control import DFControl
+from .history import History, DATEFMT
+from .defaults import DEFAULT_CONFIG, CONFIG_PATH
+from .mdsutils import config
+
+def simulate(t, r, thresholds, smooth_win, min_run,
+             event_th, max_gap=60, max_latency=300):
+    """run one candidate over the data and summarize the result
+
+    return dict with:
+      time_in_level - seconds spent at each level (gaps in the data
+                      longer than max_gap are not counted)
+      switches      - number of level changes
+      events        - number of times r crossed above event_th
+      latency       - mean seconds from an event until level >= 1
+      missed        - events with no reaction within max_latency
+    """
+    dfc = DFControl(thresholds, smooth_win, min_run)
+    sv, level = dfc.update_batch(t, r)
+    n = len(t)
+
+    dt = np.diff(t, append=t[-1:])
+    dt[dt > max_gap] = 0
+    til = [ float(dt[level == i].sum()) for i in range(len(thresholds)) ]
+    switches = int(np.count_nonzero(np.diff(level)))
+
+    onsets = np.flatnonzero((r[1:] > event_th) & (r[:-1] <= event_th)) + 1
+    up = np.where(level >= 1, np.arange(n), n)
+    nxt = np.minimum.accumulate(up[::-1])[::-1][onsets]
+    reacted = nxt < n
+    lat = t[nxt[reacted]] - t[onsets[reacted]]
+    ok = lat <= max_latency
+    latency = float(lat[ok].mean()) if ok.any() else float('nan')
+
+    return {'time_in_level': til,
+            'switches': switches,
+            'events': len(onsets),
+            'latency': latency,
+            'missed': int(len(onsets) - ok.sum())}
+
+_data = None
+def _init_worker(t, r):
+    global _data
+    _data = (t, r)
+
+def _run_candidate(args):
+    cand, event_th, max_gap, max_latency = args
+    t, r = _data
+    return simulate(t, r, *cand, event_th=event_th, max_gap=max_gap,
+                    max_latency=max_latency)
+
+def make_grid(threshold_sets, scales, smooth_wins, min_runs):
+    """return the list of (thresholds, smooth_win, min_run) candidates"""
+    ths = [ [ s * th for th in ts ] for ts in threshold_sets for s in scales ]
+    return list(itertools.product(ths, smooth_wins, min_runs))
+
+def sweep(t, r, grid, event_th, max_gap=60, max_latency=300, workers=None):
+    """simulate every candidate in grid, spread across worker processes"""
+    args = [ (cand, event_th, max_gap, max_latency) for cand in grid ]
+    if workers is None: workers = os.cpu_count() or 1
+    chunksize = max(1, len(args) // (4 * workers))
+    with concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=_init_worker, initargs=(t, r)) as ex:
+        return list(ex.map(_run_candidate, args, chunksize=chunksize))
+
+def _floats(s):
+    return [ float(x) for x in s.split(',') ]
+
+def main(argv=None):
+    p = argparse.ArgumentParser(
+        description='replay data logs for a grid of control parameters')
+    a = p.add_argument
+    a('-C', '--conf', help='append FILE to the config file path')
+    a('--data-prefix', help='data log prefix (default: from config)')
+    a('--start', help='first day to replay (YYYY-MM-DD)')
+    a('--end', help='last day to replay (YYYY-MM-DD, default: today)')
+    a('--days', type=int, default=90,
+      help='number of days to replay if --start is not given')
+    a('-t', '--thresholds', type=_floats, action='append',
+      help='comma-separated threshold set; may be repeated '
+      '(default: from config)')
+    a('--scale', type=_floats, default=[1.0],
+      help='comma-separated factors applied to each threshold set')
+    a('--smooth-win', type=_floats, default=[60.0],
+      help='comma-separated smoothing windows (seconds)')
+    a('--min-run', type=_floats, default=[300.0],
+      help='comma-separated minimum run times (seconds)')
+    a('--event-threshold', type=float,
+      help='raw reading that counts as a dust event for the latency '
+      'figures (default: second configured threshold)')
+    a('--max-latency', type=float, default=300.0,
+      help='events with no reaction within this many seconds are missed')
+    a('-j', '--workers', type=int, help='number of worker processes')
+    a('-o', '--output', help='also write the results to this CSV file')
+    args = p.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.conf: CONFIG_PATH.append(args.conf)
+    c_default = config.load_config(DEFAULT_CONFIG, source='<default>')
+    conf = config.merge_configs([c_default] +
+                                config.load_config_files(CONFIG_PATH))
+    prefix = args.data_prefix or conf.data_prefix
+    threshold_sets = args.thresholds or [conf.thresholds]
+    event_th = args.event_threshold
+    if event_th is None: event_th = conf.thresholds[1]
+
+    if args.end: end = datetime.datetime.strptime(args.end, DATEFMT).date()
+    else:        end = datetime.date.today()
+    if args.start:
+        start = datetime.datetime.strptime(args.start, DATEFMT).date()
+    else:
+        start = end - datetime.timedelta(days=args.days - 1)
+
+    h = History(prefix)
+    t0 = time.mktime(start.timetuple())
+    t1 = time.mktime((end + datetime.timedelta(days=1)).timetuple())
+    t, r, level = h.range(t0, t1)
+    if len(t) < 2:
+        logging.error('no data found for %s%s .. %s', prefix, start, end)
+        return 1
+    logging.info('loaded %d samples from %d files', len(t),
+                 len(h.files(t0, t1)))
+
+    grid = make_grid(threshold_sets, args.scale, args.smooth_win,
+                     args.min_run)
+    t0 = time.time()
+    results = sweep(t, r, grid, event_th, max_latency=args.max_latency,
+                    workers=args.workers)
+    logging.info('simulated %d candidates in %.1f seconds',
+                 len(grid), time.time() - t0)
+
+    nl = max(len(th) for th, sw, mr in grid)
+    header = ['thresholds', 'smooth_win', 'min_run'] + \
+        [ 'level%d_h' % i for i in range(nl) ] + \
+        ['switches', 'events', 'latency', 'missed']
+    rows = []
+    for (th, sw, mr), res in zip(grid, results):
+        til = res['time_in_level'] + [0.0] * (nl - len(th))
+        rows.append([ ' '.join('%g' % x for x in th), '%g' % sw, '%g' % mr ]
+                    + [ '%.1f' % (s / 3600) for s in til ]
+                    + [ res['switches'], res['events'],
+                        '%.1f' % res['latency'], res['missed'] ])
+
+    widths = [ max(len(str(x)) for x in col) for col in zip(header, *rows) ]
+    for row in [header] + rows:
+        print('  '.join('%*s' % (w, x) for w, x in zip(widths, row)))
+
+    if args.output:
+        with open(args.output, 'w', newline='') as fo:
+            w = csv.writer(fo)
+            w.writerow(header)
+            w.writerows(rows)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
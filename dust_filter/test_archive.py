@@ -0,0 +1,109 @@
+"""archive.py tests
+
+    python3 -m unittest dust_filter.test_archive
+"""
+
+import datetime
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from . import archive
+
+DATA = b''.join(b'%r,0.0123,1\n' % (1589722589.97081 + 5 * i)
+                for i in range(1000))
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.dir, 'dust_')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def log(self, day, suffix='', data=DATA):
+        path = self.prefix + day + suffix
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def listdir(self):
+        return sorted(os.listdir(self.dir))
+
+    def test_find(self):
+        """the uncompressed log first, then a compressed copy"""
+        path = self.prefix + '2020-05-17'
+        self.assertIsNone(archive.find(path))
+        for ext in ('xz', 'gz'):
+            with open(path + '.' + ext, 'wb'): pass
+            self.assertEqual(archive.find(path), path + '.' + ext)
+        self.log('2020-05-17')
+        self.assertEqual(archive.find(path), path)
+        self.assertEqual(archive.base(path + '.xz'), path)
+        self.assertEqual(archive.base(path + '.dfl'), path + '.dfl')
+        self.assertFalse(archive.is_compressed(path + '.dfl'))
+
+    def test_compress(self):
+        for method in archive.COMPRESSORS:
+            path = self.log('2020-05-17')
+            os.utime(path, (1589800000, 1589800000))
+            dst = archive.compress(path, method)
+            self.assertEqual(dst, path + '.' + method)
+            self.assertEqual(self.listdir(), ['dust_2020-05-17.' + method])
+            self.assertLess(os.path.getsize(dst), len(DATA))
+            self.assertEqual(os.path.getmtime(dst), 1589800000)
+            self.assertEqual(archive.read(archive.find(path)), DATA)
+            os.remove(dst)
+
+    def test_deterministic(self):
+        """the same log always compresses to the same bytes"""
+        out = []
+        for i in range(2):
+            path = self.log('2020-05-17')
+            os.utime(path, (1589800000 + i, 1589800000 + i))
+            with open(archive.compress(path), 'rb') as f:
+                out.append(f.read())
+            os.remove(path + '.gz')
+        self.assertEqual(out[0], out[1])
+
+    def test_run(self):
+        for day in ('2020-05-10', '2020-05-15', '2020-05-16', '2020-05-17'):
+            self.log(day)
+            self.log(day, '.dfl')
+            self.log(day, '.idx', b'')
+            self.log(day, '.dfl.crc', b'')
+        self.log('2020-05-14', '.gz', b'')
+        self.log('2020-05-20', '.notes', b'')
+        a = archive.Archiver(self.prefix, 'gz', keep_days=2)
+        a.run(datetime.date(2020, 5, 17))
+        self.assertEqual(self.listdir(), [
+            'dust_2020-05-15.dfl.crc', 'dust_2020-05-15.dfl.gz',
+            'dust_2020-05-15.gz', 'dust_2020-05-15.idx',
+            'dust_2020-05-16.dfl.crc', 'dust_2020-05-16.dfl.gz',
+            'dust_2020-05-16.gz', 'dust_2020-05-16.idx',
+            'dust_2020-05-17', 'dust_2020-05-17.dfl',
+            'dust_2020-05-17.dfl.crc', 'dust_2020-05-17.idx',
+            'dust_2020-05-20.notes'])
+        self.assertEqual(archive.read(self.prefix + '2020-05-16.dfl.gz'),
+                         DATA)
+
+    def test_keep_all(self):
+        """no compression and keep_days=0 leave everything alone"""
+        for day in ('2019-01-01', '2020-05-16', '2020-05-17'):
+            self.log(day)
+        before = self.listdir()
+        archive.Archiver(self.prefix, None, 0).run(datetime.date(2020, 5, 17))
+        self.assertEqual(self.listdir(), before)
+        self.assertRaises(ValueError, archive.Archiver, self.prefix, 'zip')
+
+    def test_start(self):
+        self.log('2020-05-16')
+        a = archive.Archiver(self.prefix)
+        a.start(time.mktime((2020, 5, 17, 12, 0, 0, 0, 0, -1)))
+        a.join()
+        self.assertEqual(self.listdir(), ['dust_2020-05-16.gz'])
+
+if __name__ == '__main__':
+    unittest.main()
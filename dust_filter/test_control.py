@@ -0,0 +1,137 @@
+"""control.py tests
+
+    python3 -m unittest dust_filter.test_control
+"""
+
+import random
+import unittest
+
+import numpy as np
+
+from . import control
+
+T0 = 1589722589.97081
+THRESH = [0.01, 0.02, 0.04, 0.08]
+
+class ListControl(control.DFControl):
+    """DFControl with the original list buffer, as a reference"""
+    def __init__(self, thresholds, smooth_win=60, min_run=300):
+        control.DFControl.__init__(self, thresholds, smooth_win, min_run)
+        self._buf = []
+
+    def _update_buf(self, v, t=None):
+        while self._buf and self._buf[0][0] < t - self._buf_len:
+            self._buf.pop(0)
+        raw = [ a[1] for a in self._buf if a[0] > t - self.smooth_win ]
+        raw.append(v)
+        sv = sum(raw)/len(raw)
+        self._buf.append( (t, v, sv) )
+        self._sv = sv
+
+def series(n, gaps=(5, 7, 20), seed=1):
+    """n (t, v) samples at irregular intervals"""
+    rnd = random.Random(seed)
+    t, out = T0, []
+    for i in range(n):
+        t += rnd.choice(gaps)
+        out.append( (t, rnd.uniform(0, 0.1)) )
+    return out
+
+class SampleRingTest(unittest.TestCase):
+    def check(self, ring, expect):
+        self.assertEqual(len(ring), len(expect))
+        got = [ (ring.t(i), ring.v(i), ring.sv(i))
+                for i in range(ring.start, ring.end) ]
+        self.assertEqual(got, expect)
+
+    def test_wraparound(self):
+        """appending past the end reuses the slots popped at the start"""
+        ring = control.SampleRing(4)
+        held = []
+        for i in range(10):
+            ring.append(i, 10 * i, 100 * i)
+            held.append( (i, 10 * i, 100 * i) )
+            if len(held) == 3:
+                ring.popleft()
+                held.pop(0)
+            self.check(ring, held)
+        self.assertEqual(ring.capacity, 4)
+
+    def test_growth(self):
+        """a full ring doubles its capacity and keeps its samples"""
+        ring = control.SampleRing(4)
+        for i in range(3):
+            ring.append(i, i, i)
+        ring.popleft()
+        ring.popleft()
+        held = [ (2, 2, 2) ]
+        for i in range(3, 12):
+            ring.append(i, i, i)
+            held.append( (i, i, i) )
+        self.check(ring, held)
+        self.assertEqual(ring.capacity, 16)
+
+class DFControlTest(unittest.TestCase):
+    def compare(self, smooth_win, min_run, n=2000):
+        ref = ListControl(THRESH, smooth_win, min_run)
+        dfc = control.DFControl(THRESH, smooth_win, min_run, capacity=4)
+        for t, v in series(n):
+            level = dfc.update(v, t)
+            self.assertEqual(level, ref.update(v, t))
+            self.assertAlmostEqual(dfc._sv, ref._sv, places=12)
+
+    def test_defaults(self):
+        self.compare(60, 300)
+
+    def test_short_run(self):
+        """min_run shorter than the gaps between samples"""
+        self.compare(30, 10)
+        self.compare(60, 0)
+
+class UpdateBatchTest(unittest.TestCase):
+    """update_batch against update() called for each sample"""
+    def check(self, smooth_win, min_run, seed):
+        rnd = random.Random(seed)
+        samples = series(3000, gaps=(1, 5, 7, 20, 45), seed=seed)
+        scalar = control.DFControl(THRESH, smooth_win, min_run)
+        batch = control.DFControl(THRESH, smooth_win, min_run)
+        i = 0
+        while i < len(samples):
+            # alternate random-sized batches with scalar updates
+            n = rnd.randint(1, 400)
+            chunk = samples[i:i + n]
+            i += n
+            t = [ s[0] for s in chunk ]
+            v = [ s[1] for s in chunk ]
+            expect_sv, expect_level = [], []
+            for ti, vi in chunk:
+                expect_level.append(scalar.update(vi, ti))
+                expect_sv.append(scalar._sv)
+            if rnd.random() < 0.5:
+                sv, level = batch.update_batch(t, v)
+            else:
+                sv, level = [], []
+                for ti, vi in chunk:
+                    level.append(batch.update(vi, ti))
+                    sv.append(batch._sv)
+            np.testing.assert_allclose(sv, expect_sv, rtol=1e-9)
+            self.assertEqual(list(level), expect_level)
+            self.assertEqual(batch._last_above, scalar._last_above)
+
+    def test_defaults(self):
+        for seed in range(3):
+            self.check(60, 300, seed)
+
+    def test_short_run(self):
+        """min_run shorter than the smooth window and the gaps"""
+        for seed in range(3):
+            self.check(60, 10, seed)
+            self.check(30, 0, seed)
+
+    def test_empty(self):
+        dfc = control.DFControl(THRESH)
+        sv, level = dfc.update_batch([], [])
+        self.assertEqual( (len(sv), len(level)), (0, 0) )
+
+if __name__ == '__main__':
+    unittest.main()
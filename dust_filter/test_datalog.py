@@ -0,0 +1,58 @@
+"""datalog.py tests
+
+    python3 -m unittest dust_filter.test_datalog
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from . import datalog
+
+T0 = 1589722589.97081
+
+class BinaryLogTest(unittest.TestCase):
+    """BinaryLog writing and reading back"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.base = os.path.join(self.dir, 'dust_')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read(self, log):
+        log.close()
+        return datalog.read_log(log.path)
+
+    def test_modes(self):
+        """modes can be names or levels"""
+        log = datalog.BinaryLog(self.base)
+        log.write(T0, 0.01, 0.01, 0, 'Auto')
+        log.write(T0 + 5, 0.02, 0.01, 1, 1)
+        log.write(T0 + 10, 0.03, 0.02, 1, 'High')
+        recs = self.read(log)
+        self.assertEqual(recs['mode'].tolist(), [4, 1, 3])
+        self.assertEqual(recs['level'].tolist(), [0, 1, 1])
+
+    def test_manual_mode(self):
+        """a reading after a manual mode change from the web is logged"""
+        from .replay import VirtualClock, ReplayPlotConn, ReplayFilter
+        clock = VirtualClock()
+        settings = {'data_prefix': self.base,
+                    'rollup_prefix': os.path.join(self.dir, 'rollup_'),
+                    'binary_log': True, 'mock_start': T0,
+                    'log_compress': 'none'}
+        df = ReplayFilter(clock, ReplayPlotConn(clock), settings)
+        df.run(T0 + 30)
+        df._web_mode('Med')
+        clock.t += 5
+        df.run(clock() + 30)
+        df.finish()
+        recs = datalog.read_log(df.logwriter.logs[1].path)
+        self.assertEqual(len(recs), 12)
+        self.assertEqual(recs['mode'][-1], datalog.MODES.index('Med'))
+        self.assertEqual(df.motor.get(), 2)
+
+if __name__ == '__main__':
+    unittest.main()
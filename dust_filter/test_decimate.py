@@ -0,0 +1,77 @@
+"""decimate.py tests
+
+    python3 -m unittest dust_filter.test_decimate
+"""
+
+import unittest
+
+import numpy as np
+
+from . import decimate
+
+class DecimateTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        self.x = 1589722589.97081 + 5 * np.arange(1000)
+        self.y = rng.uniform(0, 0.1, 1000)
+
+    def check(self, i, N):
+        """increasing indices into N samples"""
+        self.assertTrue(np.all(np.diff(i) > 0))
+        self.assertTrue(len(i) == 0 or 0 <= i[0] and i[-1] < N)
+
+    def test_short(self):
+        """n >= len keeps every sample"""
+        for n in (10, 11, 1000):
+            x, y = self.x[:10], self.y[:10]
+            self.assertEqual(decimate.minmax_indices(y, n).tolist(),
+                             list(range(10)))
+            self.assertEqual(decimate.lttb_indices(x, y, n).tolist(),
+                             list(range(10)))
+        self.assertEqual(len(decimate.minmax_indices([], 10)), 0)
+        self.assertEqual(len(decimate.lttb_indices([], [], 10)), 0)
+
+    def test_minmax(self):
+        for n in (2, 3, 10, 99, 500, 999):
+            i = decimate.minmax_indices(self.y, n)
+            self.check(i, 1000)
+            self.assertLessEqual(len(i), n + 1000 // (n // 2))
+            self.assertIn(np.argmax(self.y), i)
+            self.assertIn(np.argmin(self.y), i)
+        self.assertEqual(sorted(decimate.minmax_indices(self.y, 2)),
+                         sorted([np.argmin(self.y), np.argmax(self.y)]))
+
+    def test_lttb(self):
+        for n in (3, 4, 10, 99, 500, 999):
+            i = decimate.lttb_indices(self.x, self.y, n)
+            self.check(i, 1000)
+            self.assertEqual(len(i), n)
+            self.assertEqual( (i[0], i[-1]), (0, 999) )
+        # a spike is always picked
+        y = np.zeros(1000)
+        y[567] = 1.0
+        self.assertIn(567, decimate.lttb_indices(self.x, y, 20))
+
+    def test_few(self):
+        """n < 3 still gives no more than n samples"""
+        self.assertEqual(decimate.lttb_indices(self.x, self.y, 2).tolist(),
+                         [0, 999])
+        self.assertEqual(decimate.lttb_indices(self.x, self.y, 1).tolist(),
+                         [0])
+        self.assertEqual(len(decimate.lttb_indices(self.x, self.y, 0)), 0)
+        self.assertEqual(len(decimate.minmax_indices(self.y, 1)), 2)
+
+    def test_flat(self):
+        """flat data doesn't give repeated samples"""
+        y = np.full(1000, 0.05)
+        i = decimate.minmax_indices(y, 100)
+        self.check(i, 1000)
+        self.assertEqual(len(i), 50)
+        i = decimate.lttb_indices(self.x, y, 100)
+        self.check(i, 1000)
+        self.assertEqual(len(i), 100)
+        x, y = decimate.minmax(self.x, y, 100)
+        self.assertTrue(np.all(y == 0.05))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""dfserver.py tests
+
+    python3 -m unittest dust_filter.test_dfserver
+"""
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from . import dfserver
+from .logwriter import DailyCSV
+
+T0 = 1589722589.97081
+
+class Core(object):
+    """stands in for the core's PipeWrapCaller"""
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def history_conf(self):
+        return {'data_prefix': self.prefix, 'rollup_prefix': None,
+                'points': 5000, 'poll': 5}
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        prefix = os.path.join(self.dir, 'dust_')
+        rnd = np.random.RandomState(1)
+        self.t = T0 + np.cumsum(rnd.uniform(4.9, 5.1, 200))
+        self.r = rnd.uniform(0, 0.1, 200)
+        log = DailyCSV(prefix)
+        for t, r in zip(self.t.tolist(), self.r.tolist()):
+            log.write(t, r, r, 1, 'Auto')
+        log.close()
+        dfserver.PWC = Core(prefix)
+        dfserver._history_conf = None
+        self.client = dfserver.app.test_client()
+
+    def tearDown(self):
+        dfserver._history_conf = None
+        shutil.rmtree(self.dir)
+
+    def get(self, fmt):
+        r = self.client.get('/api/export?start=%r&end=%r&format=%s'
+                            % (T0, T0 + 2000, fmt))
+        self.assertEqual(r.status_code, 200)
+        return r.get_data(as_text=True)
+
+    def test_csv_exact(self):
+        """the export reads back the same values as the log"""
+        a = np.loadtxt(io.StringIO(self.get('csv')), delimiter=',',
+                       skiprows=1, ndmin=2)
+        self.assertEqual(a[:, 0].tolist(), self.t.tolist())
+        self.assertEqual(a[:, 1].tolist(), self.r.tolist())
+
+    def test_ndjson_exact(self):
+        rows = [ json.loads(line) for line in self.get('ndjson').splitlines() ]
+        self.assertEqual([ row['t'] for row in rows ], self.t.tolist())
+        self.assertEqual([ row['ratio'] for row in rows ], self.r.tolist())
+
+if __name__ == '__main__':
+    unittest.main()
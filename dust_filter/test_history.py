@@ -0,0 +1,136 @@
+"""history.py tests
+
+    python3 -m unittest dust_filter.test_history
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from . import archive
+from . import datalog
+from . import history
+from .logwriter import DailyCSV
+
+T0 = 1589722589.97081 # 2020-05-17, well inside the day in any timezone
+
+class HistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.dir, 'dust_')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, log, times):
+        for i, t in enumerate(times):
+            log.write(t, 0.001 * (i % 100), 0.0, i % 4, 'Auto')
+        log.close()
+
+    def test_binary_started_late(self):
+        """a binary log switched on partway through the day doesn't
+        hide the CSV readings from before"""
+        times = T0 + 5 * np.arange(100)
+        self.write(DailyCSV(self.prefix), times)
+        self.write(datalog.BinaryLog(self.prefix), times[40:])
+        h = history.History(self.prefix)
+        self.assertEqual([ os.path.basename(f) for f in
+                           h.files(T0, T0 + 500) ], ['dust_2020-05-17'])
+        t, r, level = h.range(T0, T0 + 500)
+        self.assertEqual(t.tolist(), times.tolist())
+
+    def test_binary_preferred(self):
+        times = T0 + 5 * np.arange(100)
+        self.write(DailyCSV(self.prefix), times)
+        self.write(datalog.BinaryLog(self.prefix), times)
+        h = history.History(self.prefix)
+        for compressed in (False, True):
+            if compressed:
+                for fn in os.listdir(self.dir):
+                    archive.compress(os.path.join(self.dir, fn))
+            files = h.files(T0, T0 + 500)
+            self.assertEqual(len(files), 1)
+            self.assertEqual(archive.base(files[0]),
+                             self.prefix + '2020-05-17' + datalog.SUFFIX)
+            t, r, level = h.range(T0 + 100, T0 + 200)
+            self.assertEqual(t.tolist(), times[20:40].tolist())
+
+    def test_compressed_meanwhile(self):
+        """a log compressed between files() and reading it is still read"""
+        times = T0 + 5 * np.arange(100)
+        for log in (DailyCSV(self.prefix), datalog.BinaryLog(self.prefix)):
+            self.write(log, times)
+            h = history.History(self.prefix)
+            files = h.files(T0, T0 + 500)
+            path = archive.base(files[0])
+            archive.compress(path)
+            h.files = lambda start, end: files
+            t, r, level = h.range(T0, T0 + 500)
+            self.assertEqual(t.tolist(), times.tolist())
+            os.remove(path + '.gz')
+
+class IndexTest(unittest.TestCase):
+    """the CSV .idx sidecar, with an entry every 8 rows"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.dir, 'dust_')
+        self.fn = self.prefix + '2020-05-17'
+        self.times = T0 + 5 * np.arange(150)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, times):
+        log = DailyCSV(self.prefix)
+        for i, t in enumerate(times):
+            log.write(t, 0.001 * i, 0.0, i % 4, 'Auto')
+        log.close()
+
+    def check(self, h, n):
+        """the index covers the first n rows, and ranges read right"""
+        idx, size = h.index(self.fn)
+        self.assertEqual(idx['t'].tolist(), self.times[:n:8].tolist())
+        with open(self.fn, 'rb') as f:
+            data = f.read()
+        for t, off in idx:
+            self.assertEqual(float(data[off:data.index(b',', off)]), t)
+        self.assertEqual(np.fromfile(self.fn + history.INDEX_SUFFIX,
+                                     history.INDEX_DTYPE).tolist(),
+                         idx.tolist())
+        for i, j in ((0, n), (3, 9), (8, 16), (7, 17), (n - 1, n + 5)):
+            t, r, level = h.range(self.times[0] + 5 * i,
+                                  self.times[0] + 5 * j)
+            self.assertEqual(t.tolist(), self.times[i:min(j, n)].tolist())
+
+    def test_build_and_extend(self):
+        self.write(self.times[:100])
+        h = history.History(self.prefix, every=8)
+        self.check(h, 100)
+        # a row being written isn't indexed until it's complete
+        self.write(self.times[100:150])
+        with open(self.fn, 'a') as f:
+            f.write('%r,0.1' % (self.times[-1] + 5))
+        self.check(h, 150)
+        self.check(history.History(self.prefix, every=8), 150)
+
+    def test_rebuild(self):
+        """a missing, cut short or too long index is rebuilt"""
+        self.write(self.times)
+        h = history.History(self.prefix, every=8)
+        h.index(self.fn)
+        path = self.fn + history.INDEX_SUFFIX
+        os.remove(path)
+        self.check(history.History(self.prefix, every=8), 150)
+        with open(path, 'r+b') as f:
+            f.truncate(5 * history.INDEX_DTYPE.itemsize + 3)
+        self.check(history.History(self.prefix, every=8), 150)
+        # the log replaced by a shorter one
+        os.remove(self.fn)
+        self.write(self.times[:50])
+        self.check(history.History(self.prefix, every=8), 50)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""metrics.py tests
+
+    python3 -m unittest dust_filter.test_metrics
+"""
+
+import pickle
+import unittest
+
+from . import metrics
+
+class RenderTest(unittest.TestCase):
+    def render(self, m, process='core'):
+        snap = pickle.loads(pickle.dumps(m.snapshot()))
+        return metrics.render({process: snap}).splitlines()
+
+    def test_counter(self):
+        m = metrics.Metrics()
+        m.counter('df_readings_total').inc()
+        m.counter('df_readings_total').inc(2)
+        m.gauge('df_datalog_queue').set(0.5)
+        self.assertEqual(self.render(m), [
+            '# HELP df_readings_total sensor readings taken',
+            '# TYPE df_readings_total counter',
+            'df_readings_total{process="core"} 3',
+            '# HELP df_datalog_queue readings waiting for the log writer',
+            '# TYPE df_datalog_queue gauge',
+            'df_datalog_queue{process="core"} 0.5'])
+
+    def test_histogram(self):
+        """buckets are cumulative, a value on a bound counts in it, and
+        +Inf holds everything"""
+        m = metrics.Metrics()
+        h = m.histogram('df_plot_render_seconds', bounds=(0.1, 1.0))
+        for v in (0.05, 0.1, 0.5, 3.0, 7.0):
+            h.observe(v)
+        lines = self.render(m, 'plot')[2:]
+        self.assertEqual(lines, [
+            'df_plot_render_seconds_bucket{process="plot",le="0.1"} 2',
+            'df_plot_render_seconds_bucket{process="plot",le="1.0"} 3',
+            'df_plot_render_seconds_bucket{process="plot",le="+Inf"} 5',
+            'df_plot_render_seconds_sum{process="plot"} 10.65',
+            'df_plot_render_seconds_count{process="plot"} 5'])
+
+    def test_labels(self):
+        """labels sorted after process, with \\, " and newlines escaped"""
+        m = metrics.Metrics()
+        m.counter('df_http_requests_total', status=200,
+                  path='/a"b\\c\nd').inc()
+        h = m.histogram('df_stage_seconds', stage='sensor_read')
+        h.observe(0.002)
+        lines = self.render(m)
+        self.assertIn('df_stage_seconds_bucket{process="core",'
+                      'stage="sensor_read",le="0.0025"} 1', lines)
+        self.assertIn('df_http_requests_total{process="core",'
+                      'path="/a\\"b\\\\c\\nd",status="200"} 1', lines)
+
+    def test_processes(self):
+        """one family, with a sample from each process"""
+        snaps = {}
+        for p in ('core', 'web'):
+            m = metrics.Metrics()
+            m.counter('df_rpc_requests_total').inc()
+            snaps[p] = m.snapshot()
+        lines = metrics.render(snaps).splitlines()
+        self.assertEqual(lines.count('# TYPE df_rpc_requests_total counter'),
+                         1)
+        self.assertEqual(lines[-2:], [
+            'df_rpc_requests_total{process="core"} 1',
+            'df_rpc_requests_total{process="web"} 1'])
+        self.assertEqual(metrics.render({}), '\n')
+
+    def test_undescribed(self):
+        m = metrics.Metrics()
+        self.assertRaises(KeyError, m.counter, 'df_nonsense_total')
+        self.assertRaises(KeyError, metrics.render,
+                          {'core': [('df_nonsense_total', (), 1)]})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""mtpw.py tests
+
+    python3 -m unittest dust_filter.test_mtpw
+"""
+
+import multiprocessing
+import threading
+import unittest
+
+from . import mtpw
+
+class Core(object):
+    """stands in for the core's _web_ methods"""
+    def __init__(self):
+        self.thresholds = [1.0, 2.0, 4.0, 8.0]
+
+    def _web_index(self):
+        return {'selected': 'Auto', 'active': 'Low', 'average': 1.5,
+                'thresholds': self.thresholds}
+
+    def _web_settings(self, settings=None):
+        if settings is not None: self.thresholds = settings['thresholds']
+        return {'thresholds': self.thresholds}
+
+    def _web_fail(self):
+        raise ValueError('no')
+
+class CountingConn(object):
+    """a connection that counts the messages it receives"""
+    def __init__(self, conn):
+        self.conn = conn
+        self.received = 0
+
+    def recv(self):
+        msg = self.conn.recv()
+        self.received += 1
+        return msg
+
+    def send(self, msg):
+        self.conn.send(msg)
+
+class RPCTest(unittest.TestCase):
+    def setUp(self):
+        conn, child = multiprocessing.Pipe()
+        self.core = Core()
+        self.child = CountingConn(child)
+        self.server = mtpw.PipeWrapServer(self.child, self.core, '_web_')
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        self.pwc = mtpw.PipeWrapCaller(conn, timeout=5.0)
+        self.conn = conn
+
+    def tearDown(self):
+        # the reader and server threads are daemons, blocked in recv()
+        self.conn.close()
+        self.child.conn.close()
+
+    def serve(self):
+        try:
+            while True: self.server.handle()
+        except (EOFError, OSError):
+            pass
+
+    def test_call(self):
+        self.assertEqual(self.pwc.index()['active'], 'Low')
+        self.assertEqual(self.pwc.settings({'thresholds': [1, 2, 3, 4]}),
+                         {'thresholds': [1, 2, 3, 4]})
+        self.assertRaises(mtpw.RPCError, self.pwc.fail)
+        self.assertEqual( (self.server.requests, self.server.errors), (3, 1) )
+
+    def test_batch(self):
+        """the calls are made in order, in one round trip"""
+        settings, index = self.pwc.batch(
+            ('settings', ({'thresholds': [1, 2, 3, 4]},)), ('index',))
+        self.assertEqual(settings, {'thresholds': [1, 2, 3, 4]})
+        self.assertEqual(index['thresholds'], [1, 2, 3, 4])
+        self.assertEqual(self.child.received, 1)
+        self.assertEqual(self.server.requests, 2)
+
+    def test_batch_kwargs(self):
+        r = self.pwc.batch(('settings', (), {'settings': None}))
+        self.assertEqual(r, [{'thresholds': [1.0, 2.0, 4.0, 8.0]}])
+
+    def test_batch_error(self):
+        """a failed call raises, but the others are still made"""
+        self.assertRaises(mtpw.RPCError, self.pwc.batch, ('fail',),
+                          ('settings', ({'thresholds': [1, 2, 3, 4]},)))
+        self.assertEqual(self.core.thresholds, [1, 2, 3, 4])
+        self.assertEqual( (self.server.requests, self.server.errors), (2, 1) )
+
+if __name__ == '__main__':
+    unittest.main()
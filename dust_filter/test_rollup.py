@@ -0,0 +1,118 @@
+"""rollup.py tests
+
+    python3 -m unittest dust_filter.test_rollup
+"""
+
+import datetime
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from . import rollup
+
+class LocalTime(object):
+    """run with the local timezone set to tz"""
+    def __init__(self, tz):
+        self.tz = tz
+
+    def __enter__(self):
+        self.old = os.environ.get('TZ')
+        os.environ['TZ'] = self.tz
+        time.tzset()
+
+    def __exit__(self, *exc):
+        if self.old is None: del os.environ['TZ']
+        else: os.environ['TZ'] = self.old
+        time.tzset()
+
+def local(*args):
+    return time.mktime(datetime.datetime(*args).timetuple())
+
+class DayTierTest(unittest.TestCase):
+    def check_days(self):
+        tier = rollup.Tier('day', rollup.DAY, 10)
+        # every 10 minutes from 20:00 on the 16th to 04:00 on the 18th
+        t0 = local(2020, 5, 16, 20, 0)
+        for i in range(6 * 32):
+            tier.add(t0 + 600 * i, 1, 0.01, 0.01)
+        rows = tier.rows()
+        self.assertEqual([ b.start for b in rows ],
+                         [ local(2020, 5, d) for d in (16, 17, 18) ])
+        self.assertEqual([ b.count for b in rows ], [24, 144, 24])
+
+    def test_local_midnight(self):
+        """day buckets start at local midnight, as the daily logs do"""
+        for tz in ('UTC', 'America/Los_Angeles', 'Asia/Kolkata'):
+            with LocalTime(tz):
+                self.check_days()
+
+    def test_dst(self):
+        """a day with a DST change is still one bucket"""
+        with LocalTime('America/Los_Angeles'):
+            tier = rollup.Tier('day', rollup.DAY, 10)
+            t0 = local(2020, 3, 8)
+            for i in range(23 * 6):
+                tier.add(t0 + 600 * i, 1, 0.01, 0.01)
+            tier.add(local(2020, 3, 9), 1, 0.01, 0.01)
+            self.assertEqual([ b.count for b in tier.rows() ], [23 * 6, 1])
+
+class PersistTest(unittest.TestCase):
+    """tiers written to their files and read back"""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'minute.dat')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def feed(self, tier, t0, n):
+        for i in range(n):
+            t = t0 + 10 * i
+            tier.add(t, i % 4, 0.001 * i, 0.0005 * i, i % 4, 10)
+
+    def test_round_trip(self):
+        """the buckets, including a part-filled one, survive a restart"""
+        t0 = 1589722560.0 # on a minute
+        tier = rollup.Tier('minute', 60, 100, self.path)
+        self.feed(tier, t0, 45) # 7.5 minutes
+        before = tier.rows()
+        tier.close()
+        tier = rollup.Tier('minute', 60, 100, self.path)
+        self.assertEqual(len(tier.rows()), 8)
+        for a, b in zip(before, tier.rows()):
+            self.assertEqual(a.start, b.start)
+            self.assertEqual(a.count, b.count)
+            self.assertEqual(a.level, b.level)
+            self.assertAlmostEqual(a.raw_mean, b.raw_mean, places=6)
+            self.assertEqual(a.seconds, b.seconds)
+        # the part-filled bucket is resumed, not duplicated
+        tier.add(t0 + 450, 1, 0.1, 0.1)
+        tier.close()
+        rows = rollup.Tier('minute', 60, 100, self.path).rows()
+        self.assertEqual(len(rows), 8)
+        self.assertEqual(rows[-1].count, 4)
+        recs = rollup.read_tier(self.path)
+        self.assertEqual(recs['start'].tolist(), [ b.start for b in rows ])
+        self.assertEqual(recs['count'].tolist(), [ b.count for b in rows ])
+        self.assertEqual(len(rollup.read_tier(self.path, t0 + 60, t0 + 180)),
+                         2)
+
+    def test_compaction(self):
+        """the file is rewritten with the retained buckets at twice
+        the retention"""
+        tier = rollup.Tier('minute', 60, 5, self.path)
+        self.feed(tier, 1589722560.0, 6 * 30) # 30 minutes
+        size = os.path.getsize(self.path) // rollup.RECORD.size
+        self.assertLess(size, 10)
+        tier.close()
+        starts = [ b.start for b in tier.buckets ]
+        self.assertEqual(len(starts), 5)
+        self.assertEqual(rollup.read_tier(self.path)['start'].tolist()[-5:],
+                         starts)
+        tier = rollup.Tier('minute', 60, 5, self.path)
+        self.assertEqual([ b.start for b in tier.buckets ], starts)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+"""snapshot.py tests
+
+    python3 -m unittest dust_filter.test_snapshot
+"""
+
+import os
+import subprocess
+import sys
+import threading
+import unittest
+
+from . import snapshot
+from .snapshot import StateSnapshot
+
+STATE = {'selected': 'Auto', 'active': 'Low', 'average': 1.5,
+         'thresholds': [1.0, 2.0, 4.0, 8.0]}
+
+READER = """
+from dust_filter.snapshot import StateSnapshot
+s = StateSnapshot(%r)
+print(s.read()['active'])
+s.close()
+"""
+
+class SeqlockTest(unittest.TestCase):
+    def setUp(self):
+        self.snap = StateSnapshot(create=True)
+        self.reader = StateSnapshot(self.snap.name)
+
+    def tearDown(self):
+        self.reader.close()
+        self.snap.close()
+        self.snap.unlink()
+
+    def test_round_trip(self):
+        self.assertIsNone(self.reader.read())
+        self.snap.write(dict(STATE, plot_gen=3, plot_expires=12.5), t=100.0)
+        state = self.reader.read()
+        self.assertEqual(state, dict(STATE, plot_gen=3, plot_expires=12.5,
+                                     time=100.0, version=1))
+        self.snap.write(dict(STATE, active=None,
+                             thresholds=list(range(12))))
+        state = self.reader.read()
+        self.assertIsNone(state['active'])
+        self.assertEqual(state['thresholds'],
+                         list(range(snapshot.MAX_THRESHOLDS)))
+        self.assertEqual( (state['plot_gen'], state['version']), (0, 2) )
+
+    def test_mid_write(self):
+        """a reader never sees a state while it's being written"""
+        self.snap.write(STATE)
+        snapshot._SEQ.pack_into(self.snap.buf, 0, 3) # odd: writing
+        self.assertIsNone(self.reader.read())
+        snapshot._SEQ.pack_into(self.snap.buf, 0, 4)
+        self.assertEqual(self.reader.read()['version'], 2)
+
+    def test_concurrent(self):
+        """every state read was written whole"""
+        done = threading.Event()
+        def writer():
+            i = 0
+            while not done.is_set():
+                i += 1
+                self.snap.write({'selected': 'Auto', 'active': 'Low',
+                                 'average': float(i),
+                                 'thresholds': [float(i)] * 4}, t=i)
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            last = 0
+            for n in range(20000):
+                state = self.reader.read()
+                if state is None: continue
+                self.assertEqual(state['thresholds'], [state['average']] * 4)
+                self.assertEqual(state['time'], state['average'])
+                self.assertEqual(state['version'], state['average'])
+                self.assertGreaterEqual(state['version'], last)
+                last = state['version']
+        finally:
+            done.set()
+            thread.join()
+        self.assertGreater(last, 0)
+
+class AttachTest(unittest.TestCase):
+    def setUp(self):
+        self.snap = StateSnapshot(create=True)
+
+    def tearDown(self):
+        self.snap.close()
+        self.snap.unlink()
+
+    def test_reader_exit(self):
+        """a reader in another program doesn't take the segment with it
+        when it exits"""
+        self.snap.write(STATE)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        p = subprocess.run([sys.executable, '-c', READER % self.snap.name],
+                           cwd=root, stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(p.stdout, 'Low\n')
+        self.assertNotIn('leaked', p.stderr)
+        StateSnapshot(self.snap.name).close() # still there
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,7 +25,7 @@ packages = ['dust_filter', 'dust_filter.mdsutils']
 package_dir = {'dust_filter':'dust_filter',
                'dust_filter.mdsutils':'dust_filter/mdsutils'}
 package_data= {'dust_filter': ['VERSION', 'DATE']}
-scripts = ['df2000']
+scripts = ['df2000', 'plotdust']
 data_files = [
     #('share/doc/' + name + '-' + version, ['README', 'TODO', 'ChangeLog']),
     ('share/man/man1/', ['docs/df2000.1.gz']),